@@ -0,0 +1,112 @@
+"""
+Benchmark for the fast record cleaners of `t_utils`, against the `del_none` and `strip_dict` calls they replace
+
+Records are taken from the samples at `data/samples` and mixed with generated records holding every
+`null` spelling, padded strings, trailing dots, numbers and nested values. Both cleaners are checked
+to return the same records by `tests/test_t_utils.py`.
+
+Usage:
+    python -m benchmarks.b_cleaners --records 20000 --output benchmarks/results/cleaners.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+
+from benchmarks.b_utils import SAMPLES_PATH, log_results, save_results
+from src.transformers.t_utils import (NULL_VALUES, del_none, del_none_fast, del_none_strip_fast, strip_del_none_fast,
+                                     strip_dict)
+
+JSONL_SAMPLES = (('cauth', 'cauths.jsonl'), ('cont', 'conts.jsonl'))
+BIDDER_SAMPLE = ('bidder', 'raw_json_A27178789.json')
+# Every fast cleaner and the calls it replaces
+CLEANERS = {
+    'del_none': (del_none_fast, lambda d: del_none(d)),
+    'strip_del_none': (strip_del_none_fast, lambda d: del_none(strip_dict(d))),
+    'del_none_strip': (del_none_strip_fast, lambda d: strip_dict(del_none(d))),
+}
+
+
+def get_sample_records():
+    records = []
+    for scope, fname in JSONL_SAMPLES:
+        with open(os.path.join(SAMPLES_PATH, scope, fname), mode='r', encoding='utf8') as file:
+            records += [json.loads(line) for line in file]
+    with open(os.path.join(SAMPLES_PATH, *BIDDER_SAMPLE), mode='r', encoding='utf8') as file:
+        records.append(json.load(file))
+    return records
+
+
+def get_random_value(rng, depth=0):
+    kind = rng.random()
+    if kind < 0.3:
+        return rng.choice(NULL_VALUES)
+    if kind < 0.6:
+        return rng.choice(('', ' ', '.')) + rng.choice(('Bilbao', 'ES213', '12.5', 'Sí')) + rng.choice(('', ' ', '.'))
+    if kind < 0.8:
+        return rng.choice((0, 1, 12.5, True, False))
+    if kind < 0.9 and depth < 2:
+        return {f"k{i}": get_random_value(rng, depth + 1) for i in range(rng.randint(0, 4))}
+    if depth < 2:
+        return [get_random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    return 'Araba'
+
+
+def get_records(n_records, seed=0):
+    """ Returns `n_records` records, cycling through the samples and generated ones """
+    rng = random.Random(seed)
+    records = get_sample_records()
+    records += [{f"field{i}": get_random_value(rng) for i in range(rng.randint(1, 20))} for _ in range(200)]
+    return [records[i % len(records)] for i in range(n_records)]
+
+
+def copy_records(records):
+    """ Returns deep copies of `records`, as cleaners may change them """
+    return json.loads(json.dumps(records))
+
+
+def time_cleaner(cleaner, records, repeat=3):
+    """ Returns the best time per record in microseconds, out of `repeat` runs """
+    best = None
+    for _ in range(repeat):
+        copies = copy_records(records)
+        start = time.perf_counter()
+        for d in copies:
+            cleaner(d)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(records) * 1e6
+
+
+def run_benchmark(n_records):
+    records = get_records(n_records)
+    results = {}
+    for name, (cleaner, reference) in CLEANERS.items():
+        reference_us = time_cleaner(reference, records)
+        fast_us = time_cleaner(cleaner, records)
+        results[name] = {
+            'records': len(records),
+            'reference_us': round(reference_us, 3),
+            'fast_us': round(fast_us, 3),
+            'speedup': round(reference_us / fast_us, 2),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000, help="Number of records cleaned by every cleaner")
+    parser.add_argument('--output', help="Path of the `.json` file results are stored in")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+    results = run_benchmark(args.records)
+    log_results(results)
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
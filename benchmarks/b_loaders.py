@@ -0,0 +1,155 @@
+"""
+Benchmark for the Elasticsearch loader, run against a local stand-in of the `_bulk` endpoint
+
+Every combination of chunk size, thread count and doc size is loaded with `stream_bulk`.
+The stand-in runs in its own process, so the CPU time measured is the client's alone.
+
+Usage:
+    python -m benchmarks.b_loaders --docs 20000 --chunk-sizes 100 500 2000 --thread-counts 1 4 --latency 0.02
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import time
+
+from aiohttp import web
+from elasticsearch import Elasticsearch
+
+from benchmarks.b_utils import SAMPLES_PATH, log_results, save_results
+from src.loaders.l_elasticsearch import stream_bulk
+
+ES_HEADERS = {'X-Elastic-Product': 'Elasticsearch'}
+# Size multipliers applied to the `description` of sample docs
+DOC_SIZES = {'small': 1, 'large': 20}
+
+
+def get_bulk_app(latency, reject_rate, seed=None):
+    """ Returns an app answering ping, info and `_bulk` requests as Elasticsearch does """
+    rng = random.Random(seed)
+
+    async def info(request):
+        return web.json_response({'version': {'number': '8.4.2'}, 'tagline': 'You Know, for Search'},
+                                 headers=ES_HEADERS)
+
+    async def bulk(request):
+        lines = (await request.read()).splitlines()
+        await asyncio.sleep(latency)
+        items = []
+        # Every doc takes two lines: the action and the source
+        for action_line in lines[::2]:
+            action, meta = next(iter(json.loads(action_line).items()))
+            if rng.random() < reject_rate:
+                items.append({action: {'_index': meta.get('_index'), 'status': 429,
+                                       'error': {'type': 'es_rejected_execution_exception'}}})
+            else:
+                items.append({action: {'_index': meta.get('_index'), 'status': 201, 'result': 'created'}})
+        errors = any(next(iter(item.values()))['status'] >= 300 for item in items)
+        return web.json_response({'took': int(latency * 1000), 'errors': errors, 'items': items},
+                                 headers=ES_HEADERS)
+
+    app = web.Application(client_max_size=512 * 1024 ** 2)
+    app.add_routes([web.route('*', '/', info), web.route('*', '/_bulk', bulk),
+                    web.route('*', '/{index}/_bulk', bulk)])
+    return app
+
+
+def run_bulk_server(port, latency, reject_rate, seed):
+    web.run_app(get_bulk_app(latency, reject_rate, seed), host='localhost', port=port, print=None)
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            with socket.create_connection(('localhost', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Bulk stand-in not listening on port {port}")
+
+
+def build_jsonl(fpath, n_docs, size_factor):
+    """ Writes `n_docs` docs based on the CONT samples, returning the number of bytes written """
+    with open(os.path.join(SAMPLES_PATH, 'cont', 'conts.jsonl'), mode='r', encoding='utf8') as file:
+        docs = [json.loads(doc) for doc in file]
+    n_bytes = 0
+    with open(fpath, mode='w', encoding='utf8') as jsonl:
+        for doc in itertools.islice(itertools.cycle(docs), n_docs):
+            doc = dict(doc, description=' '.join([doc.get('description') or ''] * size_factor))
+            line = json.dumps(doc, ensure_ascii=False) + '\n'
+            n_bytes += len(line.encode('utf8'))
+            jsonl.write(line)
+    return n_bytes
+
+
+def run_benchmark(n_docs, chunk_sizes, thread_counts, latency, reject_rate, seed=None):
+    """ Returns throughput and client CPU measures for every loader configuration """
+    port = get_free_port()
+    server = multiprocessing.get_context('spawn').Process(target=run_bulk_server,
+                                                          args=(port, latency, reject_rate, seed), daemon=True)
+    server.start()
+    results = {}
+    try:
+        wait_for_port(port)
+        es = Elasticsearch(f"http://localhost:{port}")
+        with tempfile.TemporaryDirectory() as path:
+            for size_name, size_factor in DOC_SIZES.items():
+                fpath = os.path.join(path, f"{size_name}.jsonl")
+                n_bytes = build_jsonl(fpath, n_docs, size_factor)
+                for chunk_size, thread_count in itertools.product(chunk_sizes, thread_counts):
+                    start = time.perf_counter()
+                    cpu_start = time.process_time()
+                    # Rejected docs are counted instead of stopping the benchmark
+                    n_ok, n_failed = stream_bulk(es, fpath, 'benchmark', chunk_size=chunk_size,
+                                                 thread_count=thread_count, raise_on_error=False)
+                    elapsed = time.perf_counter() - start
+                    results[f"{size_name}_chunk{chunk_size}_threads{thread_count}"] = {
+                        'docs': n_ok + n_failed,
+                        'rejected': n_failed,
+                        'seconds': round(elapsed, 3),
+                        'docs_per_sec': round((n_ok + n_failed) / elapsed, 1),
+                        'mb_per_sec': round(n_bytes / 1024 ** 2 / elapsed, 2),
+                        'client_cpu_seconds': round(time.process_time() - cpu_start, 3),
+                    }
+    finally:
+        server.terminate()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000, help="Number of docs loaded per configuration")
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--thread-counts', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--latency', type=float, default=0.02, help="Delay of every `_bulk` response, in seconds")
+    parser.add_argument('--reject-rate', type=float, default=0.0, help="Share of docs rejected with a 429 status")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="Path of the `.json` file results are stored in")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+    # Rejected docs are expected, do not log every one of them
+    logging.disable(logging.WARNING)
+    results = run_benchmark(args.docs, args.chunk_sizes, args.thread_counts, args.latency, args.reject_rate,
+                            args.seed)
+    logging.disable(logging.NOTSET)
+    log_results(results)
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
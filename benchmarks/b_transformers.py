@@ -0,0 +1,129 @@
+"""
+Benchmark for the transformers, based on the raw samples at `data/samples`
+
+Samples are replicated into a temporary corpus with the same layout the extractors
+store raw data in, and every transformer is run on it in a separate process.
+
+Usage:
+    python -m benchmarks.b_transformers --size 500 --output benchmarks/results/transformers.json
+    python -m benchmarks.b_transformers --size 500 --baseline benchmarks/results/baseline.json --threshold 0.15
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from benchmarks.b_utils import SAMPLES_PATH, compare_results, count_lines, log_results, run_stage, save_results
+from src.transformers.t_bidders import get_cbidders_dict
+from src.transformers.t_cauths import get_cauths_file
+from src.transformers.t_conts import get_conts_file
+from src.transformers.t_tenders.main import get_tenders_file
+
+TENDER_SAMPLES = (
+    '2019_es_eda6caef82da6347dde.xml',
+    '2020_es_0c22d2952c0492dafa3.xml',
+    '2021_es_c4bf26debcb2693b523.xml',
+    '2022_es_e5c4bf0ffe14b6ea3db.xml',
+)
+CONT_SAMPLE = '00248_2021_3123_20220209.xml'
+CAUTH_SAMPLES = (('v1', 'raw_html_v1_Izenpe.html'), ('v2', 'raw_html_v2_GobiernoVasco.html'))
+BIDDER_SAMPLE = 'raw_json_A27178789.json'
+
+
+def build_corpus(path, size):
+    """ Replicates every sample `size` times under `path`, as stored by the extractors """
+    # Tenders are stored as utf8 by `async_download_urls`
+    tenders_path = os.path.join(path, 'tenders', 'raw_xml_tenders')
+    os.makedirs(tenders_path)
+    for fname in TENDER_SAMPLES:
+        with open(os.path.join(SAMPLES_PATH, 'tender', fname), mode='r', encoding='ISO-8859-1') as file:
+            xml = file.read()
+        for i in range(size):
+            with open(os.path.join(tenders_path, f"{fname[:8]}{i:017d}.xml"), mode='w', encoding='utf8') as file:
+                file.write(xml)
+
+    conts_path = os.path.join(path, 'conts', 'raw_cauth_conts')
+    os.makedirs(conts_path)
+    with open(os.path.join(SAMPLES_PATH, 'cont', CONT_SAMPLE), mode='rb') as file:
+        xml = file.read()
+    for i in range(size):
+        with open(os.path.join(conts_path, f"{i:05d}_2021_{i}_20220209.xml"), mode='wb') as file:
+            file.write(xml)
+
+    cauths_path = os.path.join(path, 'cauths', 'raw_html')
+    os.makedirs(cauths_path)
+    for version, fname in CAUTH_SAMPLES:
+        with open(os.path.join(SAMPLES_PATH, 'cauth', fname), mode='rb') as file:
+            html = file.read()
+        for i in range(size):
+            with open(os.path.join(cauths_path, f"{version}_{i}.html"), mode='wb') as file:
+                file.write(html)
+
+    bidders_path = os.path.join(path, 'bidders', 'raw_cbidders_jsons')
+    os.makedirs(bidders_path)
+    with open(os.path.join(SAMPLES_PATH, 'bidder', BIDDER_SAMPLE), mode='r', encoding='utf8') as file:
+        bidder_d = json.load(file)
+    for i in range(size):
+        bidder_d['cif'] = f"A{i:08d}"
+        with open(os.path.join(bidders_path, f"{bidder_d['cif']}.json"), mode='w', encoding='utf8') as file:
+            json.dump(bidder_d, file, ensure_ascii=False)
+
+
+def run_tenders(path):
+    get_tenders_file(path, cache=False)
+    return count_lines(os.path.join(path, 'tenders.jsonl'))
+
+
+def run_conts(path):
+    get_conts_file(path, cache=False)
+    return count_lines(os.path.join(path, 'conts.jsonl'))
+
+
+def run_cauths(path, size):
+    cauths_dict = {str(i): {'nombreCortoEs': f"Poder adjudicador {i}"} for i in range(size)}
+    get_cauths_file(path, cauths_dict, cache=False)
+    return count_lines(os.path.join(path, 'cauths.jsonl'))
+
+
+def run_bidders(path):
+    return len(get_cbidders_dict(path, cache=False))
+
+
+def run_benchmark(size):
+    """ Returns time and memory measures for every transformer on a corpus replicated `size` times """
+    with tempfile.TemporaryDirectory() as path:
+        build_corpus(path, size)
+        return {
+            'get_tenders_file': run_stage(run_tenders, os.path.join(path, 'tenders')),
+            'get_conts_file': run_stage(run_conts, os.path.join(path, 'conts')),
+            'get_cauths_file': run_stage(run_cauths, os.path.join(path, 'cauths'), size),
+            'get_cbidders_dict': run_stage(run_bidders, os.path.join(path, 'bidders')),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100, help="Number of copies of every sample")
+    parser.add_argument('--output', help="Path of the `.json` file results are stored in")
+    parser.add_argument('--baseline', help="Path of a `.json` results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Maximum allowed drop of docs/sec against the baseline (fraction)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+    results = run_benchmark(args.size)
+    log_results(results)
+    if args.output:
+        save_results(results, args.output)
+    if args.baseline:
+        regressions = compare_results(results, args.baseline, args.threshold)
+        for regression in regressions:
+            logging.error(regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Functions shared by benchmarks for measuring stages and comparing results against a baseline
+"""
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS will not be reported
+    resource = None
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+SAMPLES_PATH = os.path.join(BENCHMARKS_PATH, '..', 'data', 'samples')
+
+
+def get_peak_rss_mb():
+    """ Returns the peak resident set size of the current process in MB """
+    if resource is None:
+        return None
+    # `ru_maxrss` is given in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def timed_call(func, *args):
+    """ Runs `func`, returning the number of docs it reports along with time and memory measures """
+    logging.basicConfig(level=logging.ERROR)
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    n_docs = func(*args)
+    elapsed = time.perf_counter() - start
+    return {
+        'docs': n_docs,
+        'seconds': round(elapsed, 3),
+        'cpu_seconds': round(time.process_time() - cpu_start, 3),
+        'docs_per_sec': round(n_docs / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+def run_stage(func, *args):
+    """ Runs `func` in a freshly spawned process, so its peak RSS is not shared with other stages """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(timed_call, func, *args).result()
+
+
+def count_lines(fpath):
+    with open(fpath, mode='rb') as file:
+        return sum(1 for _ in file)
+
+
+def save_results(results, fpath):
+    """ Stores benchmark results along with the time they were taken at """
+    os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+    with open(fpath, mode='w', encoding='utf8') as file:
+        json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'results': results}, file, indent=2)
+
+
+def compare_results(results, baseline_fpath, threshold, metric='docs_per_sec'):
+    """
+    Returns a list of messages for every stage whose `metric` dropped below the
+    baseline by more than `threshold` (a fraction of the baseline value)
+    """
+    with open(baseline_fpath, mode='r', encoding='utf8') as file:
+        baseline = json.load(file)['results']
+    regressions = []
+    for stage, measures in results.items():
+        base_value = baseline.get(stage, {}).get(metric)
+        value = measures.get(metric)
+        if not base_value or value is None:
+            continue
+        change = (value - base_value) / base_value
+        logging.info(f"{stage}: {metric} {value} vs baseline {base_value} ({change:+.1%})")
+        if change < -threshold:
+            regressions.append(f"{stage}: {metric} dropped {-change:.1%} ({base_value} -> {value})")
+    return regressions
+
+
+def log_results(results):
+    for stage, measures in results.items():
+        logging.info(f"{stage}: " + ', '.join(f"{k}={v}" for k, v in measures.items()))
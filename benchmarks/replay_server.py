@@ -0,0 +1,265 @@
+"""
+Local stand-in for the contratacion.euskadi.eus and opendata.euskadi.eus endpoints used by the extractors
+
+Responses are replayed from a raw data directory with the layout of `data/<YYYYMMDD>`, either
+recorded from a real run or generated with `benchmarks.synthetic_corpus`. Latency, server errors,
+rate limiting (429) and malformed zip files can be injected to test the extractors in isolation.
+
+Usage:
+    python -m benchmarks.replay_server data/20990101 --port 8080 --latency 0.2 --error-rate 0.05
+    KONTRATAZIOA_BASE_URL=http://localhost:8080/ KONTRATAZIOA_OPENDATA_URL=http://localhost:8080/ python main.py
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import re
+import zipfile
+from collections import Counter
+from datetime import datetime
+
+from aiohttp import web
+
+from benchmarks.synthetic_corpus import OPENDATA_URL as SOURCE_OPENDATA_URL
+from src.extractors.e_cauths import CAUTHS_LIST_FNAME
+from src.extractors.e_tenders import LAST_MODIFIED_FORMAT
+from src.utils.utils import get_hash
+
+# Error page the real server answers with, with a 200 status, for missing CAUTH pages
+CAUTH_404_HTML = "<html><body><img alt='imagen de error 404' src='error404.gif'/></body></html>"
+
+
+class Fixtures:
+    """ Raw data files available in a `data/<YYYYMMDD>` directory, indexed as the endpoints request them """
+
+    def __init__(self, path):
+        self.path = path
+        self.cauth_pages = self.index_dir('cauths', 'raw_html', r'(v[12])_(\d+)\.html',
+                                          lambda m: (m.group(2), m.group(1)))
+        if os.path.isfile(os.path.join(self.path, 'cauths', CAUTHS_LIST_FNAME)):
+            self.cauth_rows = json.loads(self.read('cauths', CAUTHS_LIST_FNAME))
+        else:
+            self.cauth_rows = [{'codPerfil': cod, 'nombreCortoEs': f"Poder adjudicador {cod}"}
+                               for cod in sorted({cod for cod, _ in self.cauth_pages}, key=int)]
+        self.cont_reports = {}
+        for fname in self.list_dir('conts', 'raw_cauth_conts'):
+            cod_perfil, year, report_id, date_modified = fname.removesuffix('.xml').split('_')
+            self.cont_reports.setdefault(str(int(cod_perfil)), []).append(
+                {'anioInforme': int(year), 'idInformeOpendata': int(report_id),
+                 'fechaModif': datetime.strptime(date_modified, '%Y%m%d').strftime('%Y-%m-%d'), 'fname': fname})
+        self.cbidders = self.index_dir('bidders', 'raw_cbidders_jsons', r'(.+)\.json', lambda m: m.group(1))
+        self.cbidder_rows = []
+        for cif, fname in sorted(self.cbidders.items()):
+            with open(os.path.join(self.path, 'bidders', 'raw_cbidders_jsons', fname), encoding='utf8') as file:
+                bidder_d = json.load(file)
+            self.cbidder_rows.append({'cif': cif, 'nEmp': bidder_d.get('nEmp'),
+                                      'denominacionSocial': bidder_d.get('denominacionSocial')})
+        self.nemp_fnames = {str(row['nEmp']): self.cbidders[row['cif']] for row in self.cbidder_rows}
+        self.catalogues = self.index_dir('tenders', 'raw_yearly_tenders', r'(\d{4})_(\d+)_(.+)\.json',
+                                         lambda m: m.group(1))
+        self.tender_xmls = {}
+        for year, fname in self.catalogues.items():
+            with open(os.path.join(self.path, 'tenders', 'raw_yearly_tenders', fname), encoding='utf8') as file:
+                catalogue = json.loads(file.read().removesuffix(');').removeprefix('jsonCallback('))
+            for tender in catalogue:
+                url = tender.get('xetrs89') or tender.get('dataXML')
+                if url:
+                    self.tender_xmls[url.removeprefix(SOURCE_OPENDATA_URL)] = (year, url)
+
+        self.rec_rows = []
+        if os.path.isfile(os.path.join(self.path, 'recs', 'recs.jsonl')):
+            with open(os.path.join(self.path, 'recs', 'recs.jsonl'), encoding='utf8') as file:
+                self.rec_rows = [json.loads(line) for line in file]
+
+    def list_dir(self, *dirs):
+        path = os.path.join(self.path, *dirs)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def index_dir(self, scope, dirname, pattern, key):
+        index = {}
+        for fname in self.list_dir(scope, dirname):
+            match = re.fullmatch(pattern, fname)
+            if match:
+                index[key(match)] = fname
+        return index
+
+    def read(self, *path_parts, mode='rb'):
+        with open(os.path.join(self.path, *path_parts), mode=mode) as file:
+            return file.read()
+
+
+class ReplayServer:
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1,
+                 bad_zip_rate=0.0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.bad_zip_rate = bad_zip_rate
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+
+    def get_app(self):
+        app = web.Application(middlewares=[self.faults], client_max_size=16 * 1024 ** 2)
+        app.add_routes([
+            web.get('/ac70cPublicidadWar/busquedaInformesOpenData/autocompleteObtenerPoderes', self.cauth_list),
+            web.get(r'/w32-kpeperfi/es/contenidos/poder_adjudicador/poder{cod}/es_doc/{page}', self.cauth_page),
+            web.get('/w32-kpetrans/es/ac70cPublicidadWar/busquedaInformesOpenData', self.cookies),
+            web.post('/w32-kpetrans/es/ac70cPublicidadWar/busquedaInformesOpenData/tablaInformes/filter',
+                     self.cont_reports),
+            web.get('/w32-kpetrans/es/ac70cPublicidadWar/indicadorREST/descargarInformeOpenData', self.cont_zip),
+            web.get('/ac70cPublicidadWar/busquedaAnuncios/autocompleteAdjudicatarios', self.empty_list),
+            web.post('/w32-kpesimpc/es/ac71aBusquedaRegistrosWar/empresas/filter', self.cbidder_list),
+            web.post('/ac71aBusquedaRegistrosWar/empresas/find', self.cbidder_detail),
+            web.route('*', '/contenidos/ds_contrataciones/contrataciones_admin_{year}/opendata/contratos.json',
+                      self.catalogue),
+            web.get('/contenidos/anuncio_contratacion/{tail:.+}', self.tender_xml),
+            web.get('/ac70cPublicidadWar/busquedaAnuncios/{dim:autocomplete(Nuts|Cpv|Paises)}', self.empty_list),
+            web.get('/ac71aBusquedaRegistrosWar/comboMaestros/{dim}', self.empty_list),
+            web.get('/y96aResolucionesWar/busqueda/buscarListado', self.rec_list),
+        ])
+        return app
+
+    @web.middleware
+    async def faults(self, request, handler):
+        """ Delays every response and replaces some of them by server errors or rate limiting responses """
+        self.stats['requests'] += 1
+        await asyncio.sleep(max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0))
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            self.stats['500'] += 1
+            return web.Response(status=500, text="Injected server error")
+        if roll < self.error_rate + self.rate_limit_rate:
+            self.stats['429'] += 1
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+        return await handler(request)
+
+    def base_url(self, request):
+        return f"{request.scheme}://{request.host}/"
+
+    async def empty_list(self, request):
+        return web.json_response([])
+
+    async def cauth_list(self, request):
+        return web.json_response(self.fixtures.cauth_rows)
+
+    async def cauth_page(self, request):
+        version = 'v2' if request.match_info['page'] == 'index.html' else 'v1'
+        fname = self.fixtures.cauth_pages.get((request.match_info['cod'], version))
+        if not fname:
+            return web.Response(body=CAUTH_404_HTML.encode('ISO-8859-1'), content_type='text/html')
+        return web.Response(body=self.fixtures.read('cauths', 'raw_html', fname), content_type='text/html',
+                            charset='ISO-8859-1')
+
+    async def cookies(self, request):
+        return web.Response(text="", headers={'Set-Cookie': f"JSESSIONID={self.rng.getrandbits(64):016x}; Path=/"})
+
+    async def cont_reports(self, request):
+        payload = json.loads(await request.text())
+        cod_perfil = str(payload['filter']['poder']['codPerfil'])
+        # Reports are filtered by year as the real listing does, both bounds included
+        start_year = int(payload['filter'].get('anioDesde') or 0)
+        end_year = int(payload['filter'].get('anioHasta') or 9999)
+        reports = [{k: v for k, v in report.items() if k != 'fname'}
+                   for report in self.fixtures.cont_reports.get(cod_perfil, [])
+                   if start_year <= report['anioInforme'] <= end_year]
+        return web.json_response(get_page(reports, payload))
+
+    async def cont_zip(self, request):
+        cod_perfil, year = request.query['idPoder'], int(request.query['anio'])
+        reports = [r for r in self.fixtures.cont_reports.get(cod_perfil, []) if r['anioInforme'] == year]
+        if not reports:
+            return web.Response(status=404)
+        if self.rng.random() < self.bad_zip_rate:
+            self.stats['bad_zip'] += 1
+            return web.Response(body=b"PK\x03\x04 truncated zip", content_type='application/zip')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zfile:
+            zfile.writestr(f"informe_{cod_perfil}_{year}.xml",
+                           self.fixtures.read('conts', 'raw_cauth_conts', reports[-1]['fname']))
+        return web.Response(body=buffer.getvalue(), content_type='application/zip')
+
+    async def cbidder_list(self, request):
+        payload = json.loads(await request.text() or '{}')
+        return web.json_response(get_page(self.fixtures.cbidder_rows, payload))
+
+    async def rec_list(self, request):
+        return web.json_response(get_page(self.fixtures.rec_rows, request.query))
+
+    async def cbidder_detail(self, request):
+        payload = json.loads(await request.text())
+        fname = self.fixtures.nemp_fnames.get(str(payload.get('nEmp')))
+        if not fname:
+            return web.Response(status=404)
+        return web.Response(body=self.fixtures.read('bidders', 'raw_cbidders_jsons', fname),
+                            content_type='application/json')
+
+    async def catalogue(self, request):
+        fname = self.fixtures.catalogues.get(request.match_info['year'])
+        if not fname:
+            return web.Response(status=404)
+        _, last_modified, etag = fname.removesuffix('.json').split('_', 2)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Last-Modified': datetime.strptime(last_modified[:14], LAST_MODIFIED_FORMAT).strftime(
+                '%a, %d %b %Y %H:%M:%S GMT'),
+        }
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        # Point tender XML urls at this server
+        body = self.fixtures.read('tenders', 'raw_yearly_tenders', fname, mode='r').replace(
+            SOURCE_OPENDATA_URL, self.base_url(request))
+        return web.Response(text=body, headers=headers, content_type='application/json')
+
+    async def tender_xml(self, request):
+        path = request.path.removeprefix('/')
+        if path not in self.fixtures.tender_xmls:
+            return web.Response(status=404)
+        year, url = self.fixtures.tender_xmls[path]
+        fname = f"{year}_es_{get_hash(url)[0:25]}.xml"
+        return web.Response(body=self.fixtures.read('tenders', 'raw_xml_tenders', fname), content_type='text/xml')
+
+
+def get_page(rows, payload):
+    """ Returns a page of `rows` as the server paginates table filters """
+    page_size = int(payload.get('rows') or len(rows) or 1)
+    page = int(payload.get('page') or 1)
+    return {
+        'page': page,
+        'total': max(-(-len(rows) // page_size), 1),
+        'records': len(rows),
+        'rows': rows[(page - 1) * page_size: page * page_size],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="Raw data directory responses are replayed from, such as `data/20990101`")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean response delay, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Maximum deviation of the delay, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of 500 responses")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of 429 responses")
+    parser.add_argument('--retry-after', type=int, default=1, help="`Retry-After` of 429 responses, in seconds")
+    parser.add_argument('--bad-zip-rate', type=float, default=0.0, help="Share of malformed CONT zip files")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+    server = ReplayServer(Fixtures(args.path), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                          bad_zip_rate=args.bad_zip_rate, seed=args.seed)
+    try:
+        web.run_app(server.get_app(), host=args.host, port=args.port)
+    finally:
+        logging.info(f"Served: {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
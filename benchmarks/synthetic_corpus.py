@@ -0,0 +1,322 @@
+"""
+Generator of synthetic raw procurement data for load testing
+
+Files are written with the same names, layout and encodings the extractors store them with,
+so the resulting directory can be used as a `data/<YYYYMMDD>` operation directory:
+    · cauths/raw_html and cauths/raw_cauths_list.json: v1 and v2 CAUTH html pages and the CAUTH list.
+    · conts/raw_cauth_conts: CONT open data report `.xml` files.
+    · bidders/raw_cbidders_jsons: CBIDDER detail `.json` files.
+    · tenders/raw_yearly_tenders and tenders/raw_xml_tenders: yearly catalogues and TENDER `.xml`
+      files, in the `record` (up to 2021) and `contractingAnnouncement` (from 2021) dialects.
+    · recs/recs.jsonl: REC (appeal resolutions) listing, from the latest resolution.
+
+Documents are variants of the samples at `data/samples`, so they follow the real schemas.
+Codes are shared between entities so joins between them match.
+
+Usage:
+    python -m benchmarks.synthetic_corpus data/20990101 --conts 300000 --tenders 30000 --bidders 10000
+"""
+import argparse
+import html
+import json
+import logging
+import math
+import os
+import random
+import re
+from datetime import date, datetime, timedelta
+
+from benchmarks.b_utils import SAMPLES_PATH
+from src.extractors.e_cauths import CAUTHS_LIST_FNAME
+from src.extractors.e_tenders import LAST_MODIFIED_FORMAT
+from src.transformers.t_bidders import ALIAS_NUTS
+from src.transformers.t_cauths import ALIAS_TYPE_MAIN_ACTIVITY
+from src.transformers.t_conts import ALIAS_TYPE_CONT
+from src.utils.utils import get_hash
+
+OPENDATA_URL = "https://opendata.euskadi.eus/"
+TENDER_XML_URL = OPENDATA_URL + "contenidos/anuncio_contratacion/exp{id}/es_{id}/data/es_r01dtpd{id}.xml"
+CONT_NS = 'com/ejie/ac70a/xml/opendata'
+CAUTH_TYPES = ('Autoridad regional o local', 'Organismo de Derecho público', 'Otros', 'Empresa pública')
+DIALECT_TEMPLATES = {
+    'record': ('2019_es_eda6caef82da6347dde.xml', '2020_es_0c22d2952c0492dafa3.xml'),
+    'cann': ('2021_es_c4bf26debcb2693b523.xml', '2022_es_e5c4bf0ffe14b6ea3db.xml'),
+}
+
+
+def read_sample(scope, fname, encoding='utf8'):
+    with open(os.path.join(SAMPLES_PATH, scope, fname), mode='r', encoding=encoding) as file:
+        return file.read()
+
+
+def get_sample_values():
+    """ Returns real CPV and NUTS codes found in the CONT samples """
+    cpvs, nuts = set(), set()
+    with open(os.path.join(SAMPLES_PATH, 'cont', 'conts.jsonl'), mode='r', encoding='utf8') as jsonl:
+        for doc in jsonl:
+            doc_d = json.loads(doc)
+            cpvs.add(doc_d.get('cpv'))
+            nuts.add(doc_d.get('location_nuts'))
+    return sorted(cpvs - {None}), sorted(nuts - {None})
+
+
+class Noise:
+    """ Picks values for fields normalized through `ALIAS_*` dicts """
+
+    def __init__(self, rng, alias_rate, unknown_rate):
+        self.rng = rng
+        self.alias_rate = alias_rate
+        self.unknown_rate = unknown_rate
+
+    def pick(self, alias_d):
+        """
+        Returns an alias of `alias_d`, which is a canonical value most of the times, a
+        non-canonical spelling with `alias_rate` and an unknown one with `unknown_rate`
+        """
+        roll = self.rng.random()
+        if roll < self.unknown_rate:
+            return f"Alias desconocido {self.rng.randint(1, 5)}"
+        aliases = [k for k in alias_d if isinstance(k, str) and k != 'null']
+        canonical = [k for k in aliases if alias_d[k] == k] or aliases
+        return self.rng.choice(aliases if roll < self.unknown_rate + self.alias_rate else canonical)
+
+
+def sub_tag(xml, tag, value):
+    """ Replaces the text of the first `tag` element in `xml` """
+    return re.sub(f"<{tag}>[^<]*</{tag}>", lambda _: f"<{tag}>{html.escape(str(value))}</{tag}>", xml, count=1)
+
+
+def sub_item(xml, name, value, key='valor'):
+    """ Replaces the `key` value of the first `name` item of a `record` TENDER """
+    pattern = f'(<item name="{name}".*?<item name="{key}"[^>]*>\\s*<value><!\\[CDATA\\[)[^\\]]*(\\]\\])'
+    return re.sub(pattern, lambda m: m.group(1) + str(value) + m.group(2), xml, count=1, flags=re.S)
+
+
+def sub_cdata(xml, name, value):
+    pattern = f'(<item name="{name}"[^>]*>\\s*<value><!\\[CDATA\\[)[^\\]]*(\\]\\])'
+    return re.sub(pattern, lambda m: m.group(1) + str(value) + m.group(2), xml, count=1, flags=re.S)
+
+
+def sub_section(page, title, value):
+    """ Replaces the text of the section titled `title` of a CAUTH html page """
+    pattern = f'(class="r01SeccionTitulo">{title}</div>\\s*<div[^>]*class="r01SeccionTexto">)[^<]*(</div>)'
+    return re.sub(pattern, lambda m: m.group(1) + html.escape(value) + m.group(2), page, count=1)
+
+
+def random_date(rng, year):
+    return date(year, 1, 1) + timedelta(days=rng.randrange(365))
+
+
+def get_cont_template():
+    """ Returns the CONT sample report as a string template for a single `contratoOpenData` node """
+    xml = read_sample('cont', '00248_2021_3123_20220209.xml')
+    return re.search(r'\s*<contratoOpenData>.*</contratoOpenData>', xml, flags=re.S).group(0)
+
+
+def gen_conts(path, rng, noise, n_conts, years, cauth_ids, bidders, cod_exps, cpvs, nuts):
+    """ Writes `n_conts` CONTs spread over open data reports with a skewed size distribution """
+    path = os.path.join(path, 'conts', 'raw_cauth_conts')
+    os.makedirs(path, exist_ok=True)
+    template = get_cont_template()
+    reports = [(cauth_id, year) for cauth_id in cauth_ids for year in years]
+    weights = [rng.lognormvariate(0, 1.5) for _ in reports]
+    total_weight = sum(weights)
+    sizes = [math.floor(n_conts * w / total_weight) for w in weights]
+    sizes[0] += n_conts - sum(sizes)
+    for report_id, ((cauth_id, year), size) in enumerate(zip(reports, sizes), start=1):
+        if not size:
+            continue
+        date_modified = random_date(rng, min(year + 1, date.today().year)).strftime('%Y%m%d')
+        fname = f"{int(cauth_id):05d}_{year}_{report_id}_{date_modified}.xml"
+        with open(os.path.join(path, fname), mode='w', encoding='utf8') as file:
+            file.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<contratosOpenData xmlns="{CONT_NS}">')
+            for n in range(size):
+                cod_exp = rng.choice(cod_exps) if rng.random() < 0.7 else f"{year}/X{rng.randrange(10 ** 6):06d}"
+                cif, name = rng.choice(bidders)
+                awarded = random_date(rng, year)
+                amount = round(rng.lognormvariate(10, 1.5), 2)
+                cont = template
+                for tag, value in (
+                        ('codContrato', f"{cod_exp}_{report_id:011d}{n + 1:012d}"),
+                        ('identificacion', cif),
+                        ('razonSocial', name),
+                        ('codigo', rng.choice(nuts)),
+                        ('fechaAdjudicacion', awarded.isoformat()),
+                        ('fechaFirma', (awarded + timedelta(days=rng.randrange(30))).isoformat()),
+                        ('importeAdjudicacionSinIva', amount),
+                        ('importeAdjudicacionConIva', round(amount * 1.21, 2)),
+                        ('codCPV', rng.choice(cpvs)),
+                ):
+                    cont = sub_tag(cont, tag, value)
+                # `descripcionEs` is not unique within a CONT, so it is located after its parent tag
+                cont = re.sub(r'(<tipoContrato>\s*<descripcionEs>)[^<]*',
+                              lambda m: m.group(1) + html.escape(noise.pick(ALIAS_TYPE_CONT)), cont, count=1)
+                file.write(cont)
+            file.write('\n</contratosOpenData>\n')
+
+
+def gen_tender_record(template, rng, noise, tender_id, cod_exp, cauth_id, nuts):
+    xml = re.sub(r'<record name="es_[^"]*"', f'<record name="es_{tender_id}"', template, count=1)
+    xml = sub_cdata(xml, 'contratacion_expediente', cod_exp)
+    xml = sub_item(xml, 'contratacion_poder_adjudicador', cauth_id, key='codigo')
+    xml = sub_item(xml, 'contratacion_poder_adjudicador', f"Poder adjudicador {cauth_id}")
+    xml = sub_item(xml, 'contratacion_tipo_contrato', noise.pick(ALIAS_TYPE_CONT))
+    return sub_item(xml, 'lugar_ejecucion_principal', rng.choice(nuts), key='codigo')
+
+
+def gen_tender_cann(template, rng, noise, tender_id, cod_exp, cauth_id, nuts):
+    xml = re.sub(r'<contractingAnnouncement id="[^"]*"', f'<contractingAnnouncement id="{tender_id}"', template,
+                 count=1)
+    xml = re.sub(r'(<codExp[^>]*>)[^<]*', lambda m: m.group(1) + html.escape(cod_exp), xml, count=1)
+    xml = re.sub(r'(<idExpOrigen[^>]*>)[^<]*', lambda m: m.group(1) + html.escape(cod_exp), xml, count=1)
+    xml = re.sub(r'<contractingAuthority id="[^"]*">\s*<name([^>]*)>[^<]*',
+                 f'<contractingAuthority id="{cauth_id}">\n            <name\\1>Poder adjudicador {cauth_id}', xml,
+                 count=1)
+    xml = re.sub(r'(<contractingType[^>]*>)[^<]*', lambda m: m.group(1) + html.escape(noise.pick(ALIAS_TYPE_CONT)),
+                 xml, count=1)
+    nuts_code = rng.choice(nuts)
+    return re.sub(r'<placeExecution id="[^"]*">\s*<code([^>]*)>[^<]*',
+                  f'<placeExecution id="{nuts_code}">\n                <code\\1>{nuts_code}', xml, count=1)
+
+
+def gen_tenders(path, rng, noise, n_tenders, years, cauth_ids, nuts):
+    """ Writes yearly catalogues and `n_tenders` TENDER `.xml` files. Returns the TENDER `cod_exp` values """
+    json_path = os.path.join(path, 'tenders', 'raw_yearly_tenders')
+    xml_path = os.path.join(path, 'tenders', 'raw_xml_tenders')
+    os.makedirs(json_path, exist_ok=True)
+    os.makedirs(xml_path, exist_ok=True)
+    templates = {dialect: [read_sample('tender', fname, encoding='ISO-8859-1') for fname in fnames]
+                 for dialect, fnames in DIALECT_TEMPLATES.items()}
+    cod_exps = []
+    per_year = math.ceil(n_tenders / len(years))
+    for year in years:
+        catalogue = []
+        for n in range(min(per_year, n_tenders - len(cod_exps))):
+            tender_id = f"syn{year}{n:06d}"
+            cod_exp = f"{year}/{n:05d}"
+            cod_exps.append(cod_exp)
+            # Part of 2021 and every later year go with the `contractingAnnouncement` dialect
+            if year > 2021 or (year == 2021 and rng.random() < 0.5):
+                xml = gen_tender_cann(rng.choice(templates['cann']), rng, noise, tender_id, cod_exp,
+                                      rng.choice(cauth_ids), nuts)
+            else:
+                xml = gen_tender_record(rng.choice(templates['record']), rng, noise, tender_id, cod_exp,
+                                        rng.choice(cauth_ids), nuts)
+            url = TENDER_XML_URL.format(id=tender_id)
+            catalogue.append({'xetrs89' if year == 2018 else 'dataXML': url, 'titulo': f"Contrato {cod_exp}"})
+            with open(os.path.join(xml_path, f"{year}_es_{get_hash(url)[0:25]}.xml"), mode='w',
+                      encoding='utf8') as file:
+                file.write(xml)
+        etag = get_hash(json.dumps(catalogue))[0:16]
+        last_modified = datetime(year + 1, 1, 1).strftime(LAST_MODIFIED_FORMAT)
+        with open(os.path.join(json_path, f"{year}_{last_modified}_{etag}.json"), mode='w', encoding='utf8') as file:
+            file.write('jsonCallback(' + json.dumps(catalogue, ensure_ascii=False) + ');')
+    return cod_exps
+
+
+def gen_bidders(path, rng, noise, n_bidders):
+    """ Writes `n_bidders` CBIDDER `.json` files. Returns (cif, name) pairs for every bidder """
+    path = os.path.join(path, 'bidders', 'raw_cbidders_jsons')
+    os.makedirs(path, exist_ok=True)
+    template = json.loads(read_sample('bidder', 'raw_json_A27178789.json'))
+    bidders = []
+    for n in range(n_bidders):
+        bidder_d = dict(template)
+        bidder_d['cif'] = f"{rng.choice('ABJ')}{n:08d}"
+        bidder_d['nEmp'] = n + 1
+        bidder_d['denominacionSocial'] = f"Empresa sintética {n}, S.L."
+        bidder_d['provinciaDesCas'] = noise.pick(ALIAS_NUTS)
+        bidder_d['listaActEconomicas'] = rng.sample(template['listaActEconomicas'],
+                                                    k=rng.randint(1, len(template['listaActEconomicas'])))
+        bidders.append((bidder_d['cif'], bidder_d['denominacionSocial']))
+        with open(os.path.join(path, f"{bidder_d['cif']}.json"), mode='w', encoding='utf8') as file:
+            json.dump(bidder_d, file, ensure_ascii=False)
+    return bidders
+
+
+def gen_recs(path, rng, n_recs, years, cauth_ids, cod_exps):
+    """ Writes a REC `.jsonl` file with `n_recs` appeal resolutions, sorted from the latest one """
+    path = os.path.join(path, 'recs')
+    os.makedirs(path, exist_ok=True)
+    recs = [{'idResolucion': n + 1,
+             'fechaResolucion': random_date(rng, rng.choice(years)).isoformat(),
+             'codExpediente': rng.choice(cod_exps),
+             'codPerfil': rng.choice(cauth_ids),
+             'sentidoResolucion': rng.choice(('Estimada', 'Desestimada', 'Estimada parcialmente', 'Inadmitida'))}
+            for n in range(n_recs)]
+    with open(os.path.join(path, 'recs.jsonl'), mode='w', encoding='utf8') as file:
+        for rec in sorted(recs, key=lambda rec: (rec['fechaResolucion'], rec['idResolucion']), reverse=True):
+            file.write(json.dumps(rec, ensure_ascii=False) + '\n')
+
+
+def gen_cauths(path, rng, noise, n_cauths, nuts):
+    """
+    Writes `n_cauths` CAUTH html pages, half of them of each version, and the CAUTH list they are fetched from.
+    Returns CAUTH `codPerfil` values
+    """
+    path = os.path.join(path, 'cauths')
+    os.makedirs(os.path.join(path, 'raw_html'), exist_ok=True)
+    templates = {
+        'v1': (read_sample('cauth', 'raw_html_v1_Izenpe.html', encoding='ISO-8859-1'), 'Principal actividad'),
+        'v2': (read_sample('cauth', 'raw_html_v2_GobiernoVasco.html', encoding='ISO-8859-1'), 'Actividad principal'),
+    }
+    cauth_ids = [str(n) for n in range(1, n_cauths + 1)]
+    with open(os.path.join(path, CAUTHS_LIST_FNAME), mode='w', encoding='utf8') as file:
+        json.dump([{'codPerfil': cauth_id, 'nombreCortoEs': f"Poder adjudicador {cauth_id}"} for cauth_id in cauth_ids],
+                  file, ensure_ascii=False)
+    for cauth_id in cauth_ids:
+        version = rng.choice(('v1', 'v2'))
+        page, activity_title = templates[version]
+        page = sub_section(page, activity_title, noise.pick(ALIAS_TYPE_MAIN_ACTIVITY))
+        page = sub_section(page, 'Tipo de poder', rng.choice(CAUTH_TYPES))
+        page = sub_section(page, 'C&oacute;digo NUTS', f"{rng.choice(nuts)} Euskadi")
+        with open(os.path.join(path, 'raw_html', f"{version}_{cauth_id}.html"), mode='w', encoding='ISO-8859-1',
+                  errors='xmlcharrefreplace') as file:
+            file.write(page)
+    return cauth_ids
+
+
+def gen_corpus(path, n_cauths=800, n_conts=300000, n_tenders=30000, n_bidders=10000, n_recs=2000,
+               years=range(2015, 2023), alias_rate=0.1, unknown_rate=0.01, seed=0):
+    """ Writes a synthetic corpus of raw data at `path` """
+    rng = random.Random(seed)
+    noise = Noise(rng, alias_rate, unknown_rate)
+    years = list(years)
+    cpvs, nuts = get_sample_values()
+    cauth_ids = gen_cauths(path, rng, noise, n_cauths, nuts)
+    logging.info(f"{n_cauths} CAUTHs generated")
+    bidders = gen_bidders(path, rng, noise, n_bidders)
+    logging.info(f"{n_bidders} BIDDERs generated")
+    cod_exps = gen_tenders(path, rng, noise, n_tenders, years, cauth_ids, nuts)
+    logging.info(f"{len(cod_exps)} TENDERs generated")
+    gen_conts(path, rng, noise, n_conts, years, cauth_ids, bidders, cod_exps or ['-'], cpvs, nuts)
+    logging.info(f"{n_conts} CONTs generated")
+    gen_recs(path, rng, n_recs, years, cauth_ids, cod_exps or ['-'])
+    logging.info(f"{n_recs} RECs generated")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="Operation directory the corpus is written to, such as `data/20990101`")
+    parser.add_argument('--cauths', type=int, default=800)
+    parser.add_argument('--conts', type=int, default=300000)
+    parser.add_argument('--tenders', type=int, default=30000)
+    parser.add_argument('--bidders', type=int, default=10000)
+    parser.add_argument('--recs', type=int, default=2000)
+    parser.add_argument('--start-year', type=int, default=2015)
+    parser.add_argument('--end-year', type=int, default=date.today().year)
+    parser.add_argument('--alias-rate', type=float, default=0.1,
+                        help="Share of `ALIAS_*` fields with a non-canonical spelling")
+    parser.add_argument('--unknown-rate', type=float, default=0.01,
+                        help="Share of `ALIAS_*` fields with a spelling missing from the alias dicts")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+    gen_corpus(args.path, n_cauths=args.cauths, n_conts=args.conts, n_tenders=args.tenders, n_bidders=args.bidders,
+               n_recs=args.recs, years=range(args.start_year, args.end_year + 1), alias_rate=args.alias_rate,
+               unknown_rate=args.unknown_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
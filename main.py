@@ -1,56 +1,170 @@
+"""
+Runs the kontratazioa ETL pipeline
+
+Usage:
+    python main.py
+    python main.py --stages conts tenders --transform-only --date 20220915 --transform-workers 4
+    python main.py --stages tenders --tender-years 2021 2022 --extract-only --download-concurrency 20
+"""
+import argparse
 import logging
 import os
 from datetime import datetime
 
+import src.extractors.e_utils as e_utils
 from src.extractors.e_bidders import get_bidders
 from src.extractors.e_cauths import get_cauths
 from src.extractors.e_conts import get_conts
+from src.extractors.e_dims import get_dims
+from src.extractors.e_recs import get_recs
 from src.extractors.e_tenders import get_tenders
 from src.loaders.l_elasticsearch import load_in_es
-from src.utils import log
+from src.transformers.t_joins import enrich_conts_file, link_tenders_conts_files
+from src.utils import http_client, log, profiling
 
 DATA_PATH = os.path.join(os.getcwd(), '', 'data')
 SECRETS_PATH = os.path.join(os.getcwd(), '', 'secrets')
+DIMS_ID = 'dims'
 CAUTH_ID = 'cauths'
 CONT_ID = 'conts'
 BIDDER_ID = 'bidders'
 TENDER_ID = 'tenders'
+REC_ID = 'recs'
+JOINS_ID = 'joins'
+LOAD_ID = 'load'
+# Stages in the order they are run. Bidders are taken from the CONT `.jsonl` file, so they go after CONTs
+STAGES = (DIMS_ID, CAUTH_ID, CONT_ID, BIDDER_ID, TENDER_ID, REC_ID, JOINS_ID, LOAD_ID)
+SINKS = ('es', 'none')
+
+
+def parse_op_date(value):
+    """ Validates operation dates given as YYYYMMDD """
+    try:
+        datetime.strptime(value, "%Y%m%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date {value}, expected YYYYMMDD")
+    return value
+
+
+def parse_rate(value):
+    """ Validates request rates, 0 meaning no limit """
+    try:
+        rate = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid rate {value}, expected a number")
+    if rate < 0:
+        raise argparse.ArgumentTypeError(f"Invalid rate {value}, expected 0 (no limit) or more")
+    return rate
 
 
-def main():
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, metavar='STAGE',
+                        help=f"Stages to run, out of: {', '.join(STAGES)} (default: all of them)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--extract-only', action='store_true',
+                      help="Only fetch raw data, skipping transforms, joins and loading")
+    mode.add_argument('--transform-only', action='store_true',
+                      help="Only transform raw data already stored for `--date`, without fetching anything")
+    parser.add_argument('--date', type=parse_op_date, default=datetime.now().strftime("%Y%m%d"),
+                        help="Operation date (YYYYMMDD) naming the data directory (default: today)")
+    parser.add_argument('--download-concurrency', type=int, default=e_utils.DOWNLOAD_CONCURRENCY,
+                        help="Maximum number of simultaneous asynchronous downloads")
+    parser.add_argument('--rate-limit', type=parse_rate, default=http_client.RATE,
+                        help="Maximum number of synchronous requests per second sent to every host, 0 for no limit")
+    parser.add_argument('--transform-workers', type=int, default=1,
+                        help="Number of processes parsing raw CONT and TENDER `.xml` files")
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help="Parse tender XMLs once all of them are downloaded, instead of while downloading")
+    parser.add_argument('--no-parse-cache', action='store_true',
+                        help="Parse every raw file, instead of reusing the results of unchanged ones")
+    parser.add_argument('--tender-years', type=int, nargs=2, metavar=('START', 'END'),
+                        help="Years of the tender catalogues to fetch (default: from 2015 to the current year)")
+    parser.add_argument('--report-years', type=int, nargs=2, metavar=('START', 'END'),
+                        help="Years of the CONT open data reports to fetch (default: from 2000 to the current year)")
+    parser.add_argument('--sink', choices=SINKS, default='es',
+                        help="Where `.jsonl` files are loaded to, `none` keeps them only on disk")
+    parser.add_argument('--profile', nargs='*', metavar='STAGE',
+                        help="Profile the given stage functions (such as `get_conts`), or all of them if none given")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
     # Date related to the current operation day
-    op_date = datetime.now().strftime("%Y%m%d")
+    op_date = args.date
 
     # Directory in which data will be stored
     data_path = os.path.join(DATA_PATH, op_date)
+    if args.transform_only and not os.path.isdir(data_path):
+        raise FileNotFoundError(f"No data to transform at {data_path}")
     os.makedirs(data_path, exist_ok=True)
 
     # Enable logging
     log.start_log(os.path.join(DATA_PATH, op_date))
-    logging.info(f"Starting log for: {op_date}")
+    logging.info(f"Starting log for: {op_date}, stages: {', '.join(args.stages)}")
+    if args.profile is not None:
+        profiling.enable(os.path.join(data_path, 'profiles'), args.profile)
+    else:
+        profiling.enable_from_env(os.path.join(data_path, 'profiles'))
+    e_utils.DOWNLOAD_CONCURRENCY = args.download_concurrency
+    http_client.set_rate(args.rate_limit)
 
     # Declare project paths
     cauths_path = os.path.join(DATA_PATH, op_date, CAUTH_ID)
     conts_path = os.path.join(DATA_PATH, op_date, CONT_ID)
     bidders_path = os.path.join(DATA_PATH, op_date, BIDDER_ID)
     tenders_path = os.path.join(DATA_PATH, op_date, TENDER_ID)
+    recs_path = os.path.join(DATA_PATH, op_date, REC_ID)
+    extract, transform = not args.transform_only, not args.extract_only
+    report_years = args.report_years or (2000, None)
+    tender_years = args.tender_years or (2015, None)
+    cache = not args.no_parse_cache
+
+    try:
+        # Refresh dimensions, shared by every operation date
+        if DIMS_ID in args.stages and extract:
+            get_dims(os.path.join(DATA_PATH, 'dimensions'))
+        # Trigger ET pipelines
+        if CAUTH_ID in args.stages:
+            get_cauths(cauths_path, extract=extract, transform=transform, cache=cache)
+        if CONT_ID in args.stages:
+            get_conts(conts_path, extract=extract, transform=transform, start_year=report_years[0],
+                      end_year=report_years[1], workers=args.transform_workers, cache=cache)
+        if BIDDER_ID in args.stages:
+            get_bidders(bidders_path, extract=extract, transform=transform, cache=cache)
+        if TENDER_ID in args.stages:
+            get_tenders(tenders_path, extract=extract, transform=transform, start_year=tender_years[0],
+                        end_year=tender_years[1], workers=args.transform_workers, pipelined=not args.no_pipeline,
+                        cache=cache)
+        # RECs are cleaned while they are fetched
+        if REC_ID in args.stages and extract:
+            get_recs(recs_path)
+
+        # Denormalize entities before loading
+        if JOINS_ID in args.stages and transform:
+            enrich_conts_file(conts_path, cauths_path, bidders_path)
+            link_tenders_conts_files(tenders_path, conts_path)
 
-    # Trigger ET pipelines
-    get_cauths(cauths_path)
-    get_conts(conts_path)
-    get_bidders(bidders_path)
-    get_tenders(tenders_path)
-
-    # Load to ES
-    load_in_es(
-        (
-            (os.path.join(cauths_path, CAUTH_ID + '.jsonl'), CAUTH_ID),
-            (os.path.join(conts_path, CONT_ID + '.jsonl'), CONT_ID),
-            (os.path.join(bidders_path, BIDDER_ID + '.jsonl'), BIDDER_ID),
-            (os.path.join(tenders_path, TENDER_ID + '.jsonl'), TENDER_ID),
-        )
-        , SECRETS_PATH
-    )
+        # Load to ES the entities of the selected stages, or all of them if only loading was selected
+        if LOAD_ID in args.stages and transform and args.sink == 'es':
+            jsonl_list = (
+                (os.path.join(cauths_path, CAUTH_ID + '.jsonl'), CAUTH_ID),
+                (os.path.join(conts_path, CONT_ID + '.jsonl'), CONT_ID),
+                (os.path.join(bidders_path, BIDDER_ID + '.jsonl'), BIDDER_ID),
+                (os.path.join(tenders_path, TENDER_ID + '.jsonl'), TENDER_ID),
+                (os.path.join(recs_path, REC_ID + '.jsonl'), REC_ID),
+            )
+            load_ids = set(args.stages) & {CAUTH_ID, CONT_ID, BIDDER_ID, TENDER_ID, REC_ID}
+            jsonl_list = [(fpath, idx) for fpath, idx in jsonl_list if not load_ids or idx in load_ids]
+            # Entities may not have been fetched for this date, such as RECs on dates extracted before them
+            for fpath, idx in jsonl_list:
+                if not os.path.isfile(fpath):
+                    logging.warning(f"Skipping {idx} loading, {fpath} does not exist")
+            load_in_es([(fpath, idx) for fpath, idx in jsonl_list if os.path.isfile(fpath)], SECRETS_PATH)
+    finally:
+        # Store stage timings and counters, also for failed runs
+        log.write_metrics(data_path)
 
 
 if __name__ == "__main__":
@@ -3,76 +3,120 @@ Functions for fetching and storing data related to bidders and classified bidder
 """
 
 import json
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import requests
-
-from src.extractors.e_utils import async_download_urls
-from src.transformers.t_bidders import get_cbidders_dict
-from src.utils import log
+from src.extractors.e_utils import BASE_URL, async_download_urls
+from src.transformers.t_bidders import BidderRecord, get_cbidders_dict
+from src.utils import log, profiling, retries, telemetry
+from src.utils.utils import get_hash, get_previous_path, reuse_file
 
 SCOPE = 'bidders'
 TIME_STAMP = datetime.now().strftime("%Y%m%d")
 DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', TIME_STAMP, SCOPE)
-BIDDERS_URL = "https://www.contratacion.euskadi.eus/ac70cPublicidadWar/busquedaAnuncios/autocompleteAdjudicatarios?q="
-CBIDDERS_URL = "https://www.contratacion.euskadi.eus/w32-kpesimpc/es/ac71aBusquedaRegistrosWar/empresas/filter"
-CBIDDER_DETAIL_URL = "https://www.contratacion.euskadi.eus/ac71aBusquedaRegistrosWar/empresas/find"
+BIDDERS_URL = BASE_URL + "ac70cPublicidadWar/busquedaAnuncios/autocompleteAdjudicatarios?q="
+CBIDDERS_URL = BASE_URL + "w32-kpesimpc/es/ac71aBusquedaRegistrosWar/empresas/filter"
+CBIDDER_DETAIL_URL = BASE_URL + "ac71aBusquedaRegistrosWar/empresas/find"
+# Rows asked for in every page of the CBIDDER listing, and pages fetched at the same time
+CBIDDER_PAGE_SIZE = 1000
+CBIDDER_LISTING_WORKERS = 4
+# File keeping track of the listing row of every CBIDDER stored, used by the next run
+CBIDDERS_STATE_FNAME = 'raw_cbidders_state.json'
 
 
 def get_bidders_from_conts(path):
-    bidders_d = {}
+    """
+    Returns a dict with the CIF of every bidder in the CONT `.jsonl` file as keys and `BidderRecord` values.
+    CONTs may spell the name of a bidder in several ways, the last one listed is kept.
+    """
+    names = {}
     with open(os.path.join(path, '..', 'conts', 'conts.jsonl'), encoding='utf8') as conts_jsonl:
         for doc in conts_jsonl:
             doc_d = json.loads(doc)
-            cif = doc_d['bidder_cif']
-            name = doc_d['bidder_name']
-            if not bidders_d.get('bidder_cif'):
-                bidders_d[cif] = {'name': name}
-            else:
-                if bidders_d[cif] != name:
-                    raise ValueError(f"Given pkey CIF has multiple names {bidders_d[cif]} != {name}")
-    return bidders_d
+            names[doc_d['bidder_cif']] = doc_d['bidder_name']
+    return {cif: BidderRecord(name=name) for cif, name in names.items()}
+
+
+def get_cbidders_page(page, page_size=CBIDDER_PAGE_SIZE):
+    """ Returns a page of the CBIDDER listing, with its rows and the number of pages and records """
+    payload = json.dumps({"rows": page_size, "page": page})
+    return retries.request('POST', CBIDDERS_URL, data=payload).json()
+
+
+def get_classified_bidder_rows():
+    """ Returns the rows of every page of the CBIDDER listing, fetching several pages at a time """
+    first_page = get_cbidders_page(1)
+    rows = first_page["rows"]
+    with ThreadPoolExecutor(max_workers=CBIDDER_LISTING_WORKERS) as executor:
+        for page in executor.map(get_cbidders_page, range(2, int(first_page.get("total") or 1) + 1)):
+            rows += page["rows"]
+    if len(rows) != int(first_page["records"]):
+        logging.warning(f"CBIDDER listing returned {len(rows)} rows out of {first_page['records']} records")
+    return rows
 
 
-def get_classified_bidder_d():
-    get_rows = 10000
-    payload = json.dumps({"rows": get_rows})
-    cbidders_d = requests.post(CBIDDERS_URL, data=payload).json()
-    if int(cbidders_d["records"]) > get_rows:
-        raise BrokenPipeError("More CBIDDER records than asked for!!")
-    return cbidders_d
+def get_cbidders_state(path):
+    """ Returns the hash of the listing row of every CBIDDER stored at `path` """
+    if not path or not os.path.isfile(os.path.join(path, CBIDDERS_STATE_FNAME)):
+        return {}
+    with open(os.path.join(path, CBIDDERS_STATE_FNAME), encoding='utf-8', mode='r') as file:
+        return json.load(file)
 
 
 def get_raw_cbidders_jsons(path):
-    cbidders_d = get_classified_bidder_d()
+    """
+    Fetches and stores the detail of every CBIDDER in the listing. Details of CBIDDERs whose
+    listing row has not changed since the previous run are reused from it instead.
+    """
     # Prepare directory for bidders
     raw_dir = os.path.join(path, "raw_cbidders_jsons")
     os.makedirs(raw_dir, exist_ok=True)
+    prev_path = get_previous_path(path)
+    prev_raw_dir = os.path.join(prev_path, "raw_cbidders_jsons") if prev_path else None
+    prev_state = get_cbidders_state(prev_path)
+    state = {}
     # Preparare list of request parameters and store location list
     rqfpath_list = []
-    for cbidder in cbidders_d["rows"]:
-        fpath = os.path.join(raw_dir, f"{cbidder['cif']}.json")
+    for cbidder in get_classified_bidder_rows():
+        fname = f"{cbidder['cif']}.json"
+        row_hash = get_hash(json.dumps(cbidder, sort_keys=True))[0:25]
+        state[cbidder['cif']] = row_hash
+        if prev_state.get(cbidder['cif']) == row_hash and reuse_file(fname, prev_raw_dir, raw_dir):
+            log.count('skips')
+            continue
         request_kwargs = {'url': CBIDDER_DETAIL_URL, 'method': 'POST', 'data': json.dumps({"nEmp": cbidder["nEmp"]}),
                           'headers': {'Content-Type': 'application/json'}}
-        rqfpath_list.append((request_kwargs, fpath))
-    async_download_urls(rqfpath_list)
+        rqfpath_list.append((request_kwargs, os.path.join(raw_dir, fname)))
+    logging.info(f"CBIDDERs new or changed since the previous run: {len(rqfpath_list)} out of {len(state)}")
+    for fpath in async_download_urls(rqfpath_list):
+        # Fetch them again on the next run
+        del state[os.path.basename(fpath).removesuffix('.json')]
+    with open(os.path.join(path, CBIDDERS_STATE_FNAME), encoding='utf-8', mode='w') as file:
+        json.dump(state, file)
 
 
-def get_detailed_cbidders(path):
-    get_raw_cbidders_jsons(path)
-    return get_cbidders_dict(path)
+def get_detailed_cbidders(path, extract=True, cache=True):
+    if extract:
+        get_raw_cbidders_jsons(path)
+    return get_cbidders_dict(path, cache=cache)
 
 
 @log.start_end
-def get_bidders(path):
+@profiling.profile
+@telemetry.summarize
+def get_bidders(path, extract=True, transform=True, cache=True):
     os.makedirs(path, exist_ok=True)
-    cbidders_d = get_detailed_cbidders(path)
+    if not transform:
+        get_raw_cbidders_jsons(path)
+        return
+    cbidders_d = get_detailed_cbidders(path, extract=extract, cache=cache)
     bidders_d = get_bidders_from_conts(path)
     full_bidders_d = dict(bidders_d, **cbidders_d)
     with open(os.path.join(path, 'bidders.jsonl'), 'w', encoding='utf8') as jsonl:
         for cif in full_bidders_d:
-            to_file_d = {'cif': cif} | full_bidders_d[cif]
+            to_file_d = {'cif': cif, **full_bidders_d[cif]}
             jsonl.write(json.dumps(to_file_d, ensure_ascii=False) + '\n')
 
 
@@ -2,40 +2,51 @@
 Functions for fetching and storing data related to `CAUTH` (contracting authority) entities
 """
 
+import json
 import logging
 import os
 from datetime import datetime
 
-import requests
-
+from src.extractors.e_utils import BASE_URL
 from src.transformers.t_cauths import get_cauths_file
-from src.transformers.t_utils import del_none, strip_dict
-from src.utils import log
+from src.transformers.t_utils import del_none_strip_fast
+from src.utils import log, profiling, retries, telemetry
 
 SCOPE = "cauths"
 TIME_STAMP = datetime.now().strftime("%Y%m%d")
 DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', TIME_STAMP, SCOPE)
-BASE_URL = "https://www.contratacion.euskadi.eus/"
 CAUTH_URL = BASE_URL + "w32-kpeperfi/es/contenidos/poder_adjudicador/"
 CAUTH_URL_V1 = CAUTH_URL + "poder{codPerfil}/es_doc/es_arch_poder{codPerfil}.html"
 CAUTH_URL_V2 = CAUTH_URL + "poder{codPerfil}/es_doc/index.html"
+# File storing the CAUTH list used while fetching, so CAUTHs can be transformed again offline
+CAUTHS_LIST_FNAME = 'raw_cauths_list.json'
 
 
 def get_cauth_dict_list(verbose=False) -> list:
     """ Returns a list of CAUTH entities (dicts) """
     cauth_list_url = BASE_URL + "ac70cPublicidadWar/busquedaInformesOpenData/" \
                                 "autocompleteObtenerPoderes?q= "
-    cauth_json = requests.get(cauth_list_url).json()
-    cauths = [strip_dict(del_none(cauth)) for cauth in cauth_json]
+    cauth_json = retries.request('GET', cauth_list_url).json()
+    cauths = [del_none_strip_fast(cauth) for cauth in cauth_json]
     if verbose:
         logging.info(f"Number of PAs fetched: {len(cauths)} ")
     return cauths
 
 
-def get_cauth_dict() -> dict:
-    """ Returns a dict containing CAUTHs `codPerfil` as keys and CAUTH entities as values """
+def get_cauth_dict(path=None, fetch=True) -> dict:
+    """
+    Returns a dict containing CAUTHs `codPerfil` as keys and CAUTH entities as values,
+    taken from the CAUTH list stored at `path` if available. Otherwise, the list is fetched unless `fetch` is False.
+    """
+    if path and os.path.isfile(os.path.join(path, CAUTHS_LIST_FNAME)):
+        with open(os.path.join(path, CAUTHS_LIST_FNAME), mode='r', encoding='utf8') as file:
+            cauth_list = json.load(file)
+    elif fetch:
+        cauth_list = get_cauth_dict_list()
+    else:
+        raise FileNotFoundError(f"No CAUTH list {CAUTHS_LIST_FNAME} at {path}, it is stored when CAUTHs are fetched")
     cauths_d = {}
-    for cauth_d in get_cauth_dict_list():
+    for cauth_d in cauth_list:
         cauths_d[cauth_d["codPerfil"]] = cauth_d
     return cauths_d
 
@@ -43,32 +54,46 @@ def get_cauth_dict() -> dict:
 @log.start_end
 def get_raw_cauth_htmls(path):
     """ Fetches and stores raw html data from CAUTHs listed with `get_cauth_dict_list()` """
+    cauth_list = get_cauth_dict_list(verbose=True)
+    with open(os.path.join(path, CAUTHS_LIST_FNAME), mode='w', encoding='utf8') as file:
+        json.dump(cauth_list, file, ensure_ascii=False)
     path = os.path.join(path, 'raw_html')
     os.makedirs(path, exist_ok=True)
-    for cauth_d in get_cauth_dict_list(verbose=True):
+    for cauth_d in cauth_list:
         cauth_cod_perfil = cauth_d['codPerfil']
         # Store raw html content
-        v1_url = CAUTH_URL_V1.format(codPerfil=cauth_cod_perfil)
-        raw_html = requests.get(v1_url).content.decode('ISO-8859-1')
-        if "imagen de error 404" not in raw_html:
-            version = "v1"
-        else:
-            v2_url = CAUTH_URL_V2.format(codPerfil=cauth_cod_perfil)
-            raw_html = requests.get(v2_url).content.decode('ISO-8859-1')
-            version = "v2"
+        try:
+            v1_url = CAUTH_URL_V1.format(codPerfil=cauth_cod_perfil)
+            raw_html = retries.request('GET', v1_url).content.decode('ISO-8859-1')
+            if "imagen de error 404" not in raw_html:
+                version = "v1"
+            else:
+                v2_url = CAUTH_URL_V2.format(codPerfil=cauth_cod_perfil)
+                raw_html = retries.request('GET', v2_url).content.decode('ISO-8859-1')
+                version = "v2"
+        except retries.RetryError as e:
+            logging.error(f"Could not fetch CAUTH {cauth_cod_perfil}: {e}")
+            log.count('failures')
+            continue
         # Manage local filepath
         filename = '_'.join((version, cauth_cod_perfil)) + '.html'
         filepath = os.path.join(path, filename)
         # Store raw html
         with open(filepath, mode='w', encoding='ISO-8859-1') as file:
             file.write(raw_html)
+        log.count('downloads')
+        log.count('bytes', len(raw_html))
 
 
 @log.start_end
-def get_cauths(path):
+@profiling.profile
+@telemetry.summarize
+def get_cauths(path, extract=True, transform=True, cache=True):
     os.makedirs(path, exist_ok=True)
-    get_raw_cauth_htmls(path)
-    get_cauths_file(path, get_cauth_dict())
+    if extract:
+        get_raw_cauth_htmls(path)
+    if transform:
+        get_cauths_file(path, get_cauth_dict(path, fetch=extract), cache=cache)
 
 
 if __name__ == "__main__":
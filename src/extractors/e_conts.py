@@ -10,21 +10,22 @@ Notes:
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO
 from zipfile import ZipFile, BadZipFile
 
 import requests
 
-import src.utils.utils as utils
 from src.extractors.e_cauths import get_cauth_dict_list
+from src.extractors.e_utils import BASE_URL
 from src.transformers.t_conts import get_conts_file
-from src.utils import log
+from src.utils import http_client, log, profiling, retries, telemetry
+from src.utils.utils import get_previous_path, reuse_file
 
 SCOPE = "conts"
 TIME_STAMP = datetime.now().strftime("%Y%m%d")
 DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', TIME_STAMP, SCOPE)
-BASE_URL = "https://www.contratacion.euskadi.eus/"
 
 CONT_URL = BASE_URL + "w32-kpetrans/es/ac70cPublicidadWar/indicadorREST" \
                       "/descargarInformeOpenData" \
@@ -37,63 +38,179 @@ CONT_BY_CAUTH_LIST_URL = BASE_URL + "w32-kpetrans/es/ac70cPublicidadWar" \
                                     "/busquedaInformesOpenData" \
                                     "/tablaInformes/filter"
 
+# Page setting the cookies required to list CONT reports
+COOKIES_URL = BASE_URL + "w32-kpetrans/es/ac70cPublicidadWar" \
+                         "/busquedaInformesOpenData" \
+                         "?locale=es"
 
-@utils.retry(times=5, exceptions=BadZipFile, sleep=10)
+# Reports asked for in every page of a CAUTH listing, and pages fetched at the same time
+CONT_LIST_PAGE_SIZE = 100
+CONT_LIST_WORKERS = 4
+
+# File keeping track of the CONT reports stored for every CAUTH, used by the next run. Report file names hold
+# their (`codPerfil`, `anioInforme`, `idInformeOpendata`, `fechaModif`)
+CONTS_STATE_FNAME = 'raw_cauth_conts_state.json'
+
+
+@retries.retry(times=5, exceptions=BadZipFile)
 def get_xml_from_zip_url(url, cont_path, xml_fname):
     xml_fpath = os.path.join(cont_path, xml_fname)
-    r = requests.get(url)
-    if not r:
-        return
+    r = retries.request('GET', url)
+    r.raise_for_status()
     with ZipFile(BytesIO(r.content)) as zipfile:
         zipped_filenames = zipfile.namelist()
         if len(zipped_filenames) > 3:
-            raise BadZipFile
             logging.critical(f"Malformed zip file for: {url}")
+            raise BadZipFile
         for file in zipped_filenames:
             if file.endswith('.xml'):
                 zipfile.extract(file, cont_path)
                 os.rename(os.path.join(cont_path, file.replace('"', '_')), xml_fpath)
+    log.count('downloads')
+    log.count('bytes', len(r.content))
+
+
+def get_listing_session():
+    """ Returns a session holding the cookies required to list CONT reports """
+    session = http_client.new_session()
+    retries.request('GET', COOKIES_URL, session=session)
+    return session
+
+
+@retries.retry(times=5, exceptions=json.decoder.JSONDecodeError)
+def get_cont_reports_page(cauth_cod_perfil, page, start_year=2000, end_year=None, session=None,
+                          page_size=CONT_LIST_PAGE_SIZE):
+    """ Returns a page of the CONT reports of a CAUTH, with its rows and the number of pages and records """
+    payload = {"length": page_size, "filter": {"poder": {"codPerfil": cauth_cod_perfil}, "anioDesde": str(start_year),
+        "anioHasta": str(end_year or datetime.now().year)}, "rows": page_size, "page": page}
+    return retries.request('POST', CONT_BY_CAUTH_LIST_URL, session=session or get_listing_session(),
+                           data=json.dumps(payload), timeout=25).json()
+
+
+def get_yearly_conts_by_cauth(cauth_cod_perfil, start_year=2000, end_year=None, session=None):
+    """
+    Yields the CONT reports of a CAUTH page by page, as they are listed. Pages after the first one
+    are fetched `CONT_LIST_WORKERS` at a time, and yielded in order.
+    """
+    session = session or get_listing_session()
+    first_page = get_cont_reports_page(cauth_cod_perfil, 1, start_year, end_year, session)
+    yield from first_page["rows"]
+    n_pages = int(first_page.get("total") or 1)
+    if n_pages < 2:
+        return
+    with ThreadPoolExecutor(max_workers=CONT_LIST_WORKERS) as executor:
+        pages = [executor.submit(get_cont_reports_page, cauth_cod_perfil, page, start_year, end_year, session)
+                 for page in range(2, n_pages + 1)]
+        for page in pages:
+            yield from page.result()["rows"]
+
+
+def get_cont_xml_fname(cauth_cod_perfil, yearly_od_report):
+    od_report_year = str(int(yearly_od_report['anioInforme']))
+    od_report_date_modified = yearly_od_report['fechaModif'].replace('-', '')
+    od_report_id = str(int(yearly_od_report['idInformeOpendata']))
+    return f"{int(cauth_cod_perfil):05d}_{od_report_year}_{od_report_id}_{od_report_date_modified}.xml"
+
+
+def get_report_prefix(xml_fname):
+    """ Returns the part of a report file name shared by every version of the report """
+    return xml_fname.rsplit('_', 1)[0]
+
+
+def get_conts_state(path):
+    """ Returns the CONT report file names stored for every CAUTH at `path` """
+    if not path or not os.path.isfile(os.path.join(path, CONTS_STATE_FNAME)):
+        return {}
+    with open(os.path.join(path, CONTS_STATE_FNAME), encoding='utf-8', mode='r') as file:
+        return json.load(file)
 
 
-@utils.retry(times=5, exceptions=json.decoder.JSONDecodeError, sleep=0.5)
-def get_yearly_conts_by_cauth(cauth_cod_perfil):
-    payload = {"length": 1000000, "filter": {"poder": {"codPerfil": cauth_cod_perfil}, "anioDesde": "2000",
-        "anioHasta": str(datetime.now().year)}, "rows": 1000000, "page": 1}
-    # Cookies to be used in the following request
-    cookies_url = BASE_URL + "w32-kpetrans/es/ac70cPublicidadWar" \
-                             "/busquedaInformesOpenData" \
-                             "?locale=es"
-    cookies = requests.get(cookies_url).headers['Set-Cookie']
-    r_json = requests.post(CONT_BY_CAUTH_LIST_URL, headers={'Cookie': cookies}, data=json.dumps(payload),
-                           timeout=25).json()
-    if int(r_json['page']) > 1:
-        logging.warning("More data available than expected!")
-        raise
-    return r_json["rows"]
+def remove_superseded_xmls(xml_path, state, listed_cauths):
+    """
+    Removes the report files of listed CAUTHs that are not in `state`, such as earlier versions
+    of a modified report, so they are not parsed along with the current ones
+    """
+    xml_fnames = {xml_fname for xml_fnames in state.values() for xml_fname in xml_fnames}
+    n_removed = 0
+    for xml_fname in os.listdir(xml_path):
+        if xml_fname.endswith('.xml') and xml_fname not in xml_fnames \
+                and str(int(xml_fname.split('_')[0])) in listed_cauths:
+            os.remove(os.path.join(xml_path, xml_fname))
+            n_removed += 1
+    if n_removed:
+        logging.info(f"Superseded CONT reports removed: {n_removed}")
 
 
 @log.start_end
-def get_raw_cont_xmls(path):
+def get_raw_cont_xmls(path, start_year=2000, end_year=None):
+    """
+    Fetches and stores the CONT reports of every CAUTH for years from `start_year` to `end_year` (included).
+    Reports not modified since the previous run are reused from it instead of downloaded again.
+    """
+    xml_path = os.path.join(path, 'raw_cauth_conts')
+    os.makedirs(xml_path, exist_ok=True)
+    prev_path = get_previous_path(path)
+    prev_xml_path = os.path.join(prev_path, 'raw_cauth_conts') if prev_path else None
+    prev_state = get_conts_state(prev_path)
+    state, listed_cauths = {}, set()
+    n_new = 0
+    # Every listing is sent with the cookies of the same session
+    session = get_listing_session()
     # Iterating through every cauth contract report
     for cauth_d in get_cauth_dict_list():
         cauth_cod_perfil = cauth_d['codPerfil']
-        # Iterating through every bidder CONT in a given list
-        for yearly_od_report in get_yearly_conts_by_cauth(cauth_cod_perfil=cauth_cod_perfil):
-            od_report_year = str(int(yearly_od_report['anioInforme']))
-            od_report_date_modified = yearly_od_report['fechaModif'].replace('-', '')
-            od_report_id = str(int(yearly_od_report['idInformeOpendata']))
-            xml_fname = f"{int(cauth_cod_perfil):05d}_{od_report_year}_{od_report_id}_{od_report_date_modified}.xml"
-            xml_fpath = os.path.join(path, 'raw_cauth_conts')
-            if not os.path.isfile(os.path.join(xml_fpath, xml_fname)):
-                zip_url = CONT_URL.format(codperfil=cauth_cod_perfil, report_year=od_report_year)
-                get_xml_from_zip_url(url=zip_url, cont_path=xml_fpath, xml_fname=xml_fname)
+        state[cauth_cod_perfil] = []
+        # Reports are downloaded while the rest of the listing is still being fetched
+        try:
+            for yearly_od_report in get_yearly_conts_by_cauth(cauth_cod_perfil=cauth_cod_perfil,
+                                                              start_year=start_year, end_year=end_year,
+                                                              session=session):
+                xml_fname = get_cont_xml_fname(cauth_cod_perfil, yearly_od_report)
+                if reuse_file(xml_fname, prev_xml_path, xml_path):
+                    log.count('skips')
+                    state[cauth_cod_perfil].append(xml_fname)
+                    continue
+                zip_url = CONT_URL.format(codperfil=cauth_cod_perfil,
+                                          report_year=int(yearly_od_report['anioInforme']))
+                try:
+                    get_xml_from_zip_url(url=zip_url, cont_path=xml_path, xml_fname=xml_fname)
+                except (retries.RetryError, requests.HTTPError) as e:
+                    logging.error(f"Could not fetch CONT report {xml_fname}: {e}")
+                    log.count('failures')
+                    # Keep the previous version of the report, if any
+                    prefix = get_report_prefix(xml_fname)
+                    state[cauth_cod_perfil] += [prev_fname for prev_fname in prev_state.get(cauth_cod_perfil, [])
+                                                if get_report_prefix(prev_fname) == prefix
+                                                and reuse_file(prev_fname, prev_xml_path, xml_path)]
+                    continue
+                state[cauth_cod_perfil].append(xml_fname)
+                n_new += 1
+        except retries.RetryError as e:
+            logging.error(f"Could not list the CONT reports of CAUTH {cauth_cod_perfil}: {e}")
+            log.count('failures')
+            # Keep the reports from the previous run not listed yet, so its CONTs are not lost
+            listed_prefixes = {get_report_prefix(xml_fname) for xml_fname in state[cauth_cod_perfil]}
+            state[cauth_cod_perfil] += [xml_fname for xml_fname in prev_state.get(cauth_cod_perfil, [])
+                                        if get_report_prefix(xml_fname) not in listed_prefixes
+                                        and reuse_file(xml_fname, prev_xml_path, xml_path)]
+            continue
+        listed_cauths.add(str(int(cauth_cod_perfil)))
+    remove_superseded_xmls(xml_path, state, listed_cauths)
+    with open(os.path.join(path, CONTS_STATE_FNAME), encoding='utf-8', mode='w') as file:
+        json.dump(state, file)
+    logging.info(f"New or modified CONT reports fetched: {n_new}, reused from {prev_path}: "
+                 f"{sum(map(len, state.values())) - n_new}")
 
 
 @log.start_end
-def get_conts(path):
+@profiling.profile
+@telemetry.summarize
+def get_conts(path, extract=True, transform=True, start_year=2000, end_year=None, workers=1, cache=True):
     os.makedirs(path, exist_ok=True)
-    get_raw_cont_xmls(path)
-    get_conts_file(path)
+    if extract:
+        get_raw_cont_xmls(path, start_year=start_year, end_year=end_year)
+    if transform:
+        get_conts_file(path, workers=workers, cache=cache)
 
 
 if __name__ == "__main__":
@@ -2,17 +2,21 @@
 Functions for fetching and storing dimensions-data related to procurement
 """
 import json
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import requests
-
-from src.transformers.t_utils import del_none, strip_dict
+from src.extractors.e_utils import BASE_URL
+from src.transformers.t_dims import DIMS_STATE_FNAME, get_dims_state
+from src.transformers.t_utils import del_none_fast, strip_del_none_fast
+from src.utils import log, profiling, retries, telemetry
+from src.utils.utils import get_hash
 
 SCOPE = 'dimensions'
 TIME_STAMP = datetime.now().strftime("%Y%m%d")
 DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', SCOPE)
-BASE_URL = "https://www.contratacion.euskadi.eus/"
 NUTS_DIM_URL = BASE_URL + "ac70cPublicidadWar/busquedaAnuncios/autocompleteNuts?q="
 CPV_DIM_URL = BASE_URL + "ac70cPublicidadWar/busquedaAnuncios/autocompleteCpv?q="
 PAIS_DIM_URL = BASE_URL + "ac70cPublicidadWar/busquedaAnuncios/autocompletePaises?q="
@@ -20,99 +24,133 @@ TIPOACT_DIM_URL = BASE_URL + "ac71aBusquedaRegistrosWar/comboMaestros/getActivid
 CATEGORIA_DIM_URL = BASE_URL + "ac71aBusquedaRegistrosWar/comboMaestros/findCategoria"
 SUBGRUPO_DIM_URL = BASE_URL + "ac71aBusquedaRegistrosWar/comboMaestros/findSubgrupoCategoria"
 GRUPO_DIM_URL = BASE_URL + "ac71aBusquedaRegistrosWar/comboMaestros/findGrupoCategoria"
+# Seconds dimensions are considered current for, as they seldom change
+DIMS_TTL = 7 * 24 * 3600
+
+
+def clean_nuts_dim(nuts_list):
+    """ Yields clean `nuts` dimension rows """
+    for nuts_d in nuts_list:
+        yield del_none_fast(nuts_d['nuts'])
+
+
+def clean_cpv_dim(cpv_list):
+    """ Yields clean `cpv` dimension rows """
+    for cpv_d in cpv_list:
+        # Get rid of empty data
+        del cpv_d['cpvHijos']
+        del cpv_d['principalString']
+        yield del_none_fast(cpv_d)
+
+
+def clean_pais_dim(pais_list):
+    """ Yields clean `pais` dimension rows """
+    for pais_d in pais_list:
+        # Get rid of empty data
+        del pais_d['pais']['estado']
+        yield del_none_fast(pais_d['pais'])
+
+
+def clean_iae_dim(tipoact_list):
+    """ Yields clean `iae` (Impuesto sobre Actividades Económivas) dimension rows """
+    for tipoact_d in tipoact_list:
+        # Get rid of empty data
+        del tipoact_d['tipoActicidadEconomica']
+        tipoact_d['descTipoActividad'] = tipoact_d['descTipoActividad'].strip()
+        yield del_none_fast(tipoact_d)
 
 
-def get_nuts_dim(path):
-    """ Fetches and stores `nuts` dimension """
-    nuts_list = requests.get(NUTS_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'nuts_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for nuts_d in nuts_list:
-            file.write(json.dumps(del_none(nuts_d['nuts']), ensure_ascii=False) + '\n')
-
-
-def get_cpv_dim(path):
-    """ Fetches and stores `cpv` dimension """
-    cpv_list = requests.get(CPV_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'cpv_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for cpv_d in cpv_list:
-            # Get rid of empty data
-            del cpv_d['cpvHijos']
-            del cpv_d['principalString']
-            file.write(json.dumps(del_none(cpv_d), ensure_ascii=False) + '\n')
-
-
-def get_pais_dim(path):
-    """ Fetches and stores `pais` dimension """
-    pais_list = requests.get(PAIS_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'pais_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for pais_d in pais_list:
-            # Get rid of empty data
-            del pais_d['pais']['estado']
-            file.write(json.dumps(del_none(pais_d['pais']), ensure_ascii=False) + '\n')
-
-
-def get_iae_dim(path):
-    """ Fetches and stores `iae` (Impuesto sobre Actividades Económivas) dimension """
-    tipoact_list = requests.get(TIPOACT_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'iae_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for tipoact_d in tipoact_list:
-            # Get rid of empty data
-            del tipoact_d['tipoActicidadEconomica']
-            tipoact_d['descTipoActividad'] = tipoact_d['descTipoActividad'].strip()
-            file.write(json.dumps(del_none(tipoact_d), ensure_ascii=False) + '\n')
-
-
-def get_categoria_dim(path):
-    """ Fetches and stores `categoria` dimension """
-    categoria_list = requests.get(CATEGORIA_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'categoria_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for categoria_d in categoria_list:
-            strip_dict(categoria_d)
-            file.write(json.dumps(del_none(categoria_d), ensure_ascii=False) + '\n')
-
-
-def get_subgrupo_dim(path):
-    """ Fetches and stores `subgrupo` dimension """
-    subgrupo_list = requests.get(SUBGRUPO_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'subgrupo_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for subgrupo_d in subgrupo_list:
-            strip_dict(subgrupo_d)
-            # Get rid of empty data
-            del subgrupo_d['codPk']
-            del subgrupo_d['codPkAfin']
-            del subgrupo_d['grupo']
-            file.write(json.dumps(del_none(subgrupo_d), ensure_ascii=False) + '\n')
-
-
-def get_grupo_dim(path):
+def clean_categoria_dim(categoria_list):
+    """ Yields clean `categoria` dimension rows """
+    for categoria_d in categoria_list:
+        yield strip_del_none_fast(categoria_d)
+
+
+def clean_subgrupo_dim(subgrupo_list):
+    """ Yields clean `subgrupo` dimension rows """
+    for subgrupo_d in subgrupo_list:
+        # Get rid of empty data
+        del subgrupo_d['codPk']
+        del subgrupo_d['codPkAfin']
+        del subgrupo_d['grupo']
+        yield strip_del_none_fast(subgrupo_d)
+
+
+def clean_grupo_dim(grupo_list):
     """
-    Fetches and stores `grupo` dimension
+    Yields clean `grupo` dimension rows
         codClas":"S" -> Servicio
         codClas":"O" -> Obras
     """
-    grupo_list = requests.get(GRUPO_DIM_URL).json()
-    filepath = os.path.join(path, '_'.join((TIME_STAMP, 'grupo_dimension.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for grupo_d in grupo_list:
-            strip_dict(grupo_d)
-            file.write(json.dumps(del_none(grupo_d), ensure_ascii=False) + '\n')
-
-
-def get_dims(path):
+    for grupo_d in grupo_list:
+        yield strip_del_none_fast(grupo_d)
+
+
+# Every dimension: its url and row cleaner
+DIMS = {
+    'nuts': (NUTS_DIM_URL, clean_nuts_dim),
+    'cpv': (CPV_DIM_URL, clean_cpv_dim),
+    'pais': (PAIS_DIM_URL, clean_pais_dim),
+    'iae': (TIPOACT_DIM_URL, clean_iae_dim),
+    'categoria': (CATEGORIA_DIM_URL, clean_categoria_dim),
+    'subgrupo': (SUBGRUPO_DIM_URL, clean_subgrupo_dim),
+    'grupo': (GRUPO_DIM_URL, clean_grupo_dim),
+}
+
+
+def get_dim_lines(name):
+    """ Fetches a dimension and returns its `.jsonl` lines, or None if it cannot be fetched or is empty """
+    url, clean = DIMS[name]
+    try:
+        rows = retries.request('GET', url).json()
+        lines = [json.dumps(row, ensure_ascii=False) + '\n' for row in clean(rows)]
+    except (retries.RetryError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Could not fetch the {name} dimension: {e!r}")
+        log.count('failures')
+        return None
+    if not lines:
+        logging.warning(f"The {name} dimension was fetched empty")
+        log.count('failures')
+        return None
+    return lines
+
+
+@log.start_end
+@profiling.profile
+@telemetry.summarize
+def get_dims(path, ttl=DIMS_TTL):
+    """
+    Fetches the dimensions at the same time and stores them in `<YYYYMMDD>_<name>_dimension.jsonl` files.
+    Dimensions fetched less than `ttl` seconds ago are not fetched again, and a new file is only written
+    when the content of a dimension changed. Dimensions that cannot be fetched, or are fetched empty,
+    keep their stored file and are fetched again on the next call. Until a dimension is stored,
+    transformers use its `meta/` csv file instead (see `t_dims`).
+    """
     os.makedirs(path, exist_ok=True)
-    get_nuts_dim(path)
-    get_cpv_dim(path)
-    get_pais_dim(path)
-    get_iae_dim(path)
-    get_categoria_dim(path)
-    get_subgrupo_dim(path)
-    get_grupo_dim(path)
+    state = get_dims_state(path)
+    now = time.time()
+    names = [name for name in DIMS
+             if name not in state or now - state[name]['fetched'] >= ttl
+             or not os.path.isfile(os.path.join(path, state[name]['fname']))]
+    log.count('skips', len(DIMS) - len(names))
+    with ThreadPoolExecutor(max_workers=len(DIMS)) as executor:
+        for name, lines in zip(names, executor.map(get_dim_lines, names)):
+            if lines is None:
+                # Keep the stored dimension, if any, and fetch it again on the next call
+                continue
+            dim_hash = get_hash(''.join(lines))
+            if state.get(name, {}).get('hash') == dim_hash:
+                state[name].update(fetched=now)
+                log.count('skips')
+                continue
+            fname = '_'.join((TIME_STAMP, name + '_dimension.jsonl'))
+            with open(os.path.join(path, fname), 'w', encoding='utf8') as file:
+                file.writelines(lines)
+            state[name] = {'fetched': now, 'hash': dim_hash, 'fname': fname}
+            log.count('records', len(lines))
+            logging.info(f"Dimension {name} changed, stored in {fname} ({len(lines)} rows)")
+    with open(os.path.join(path, DIMS_STATE_FNAME), encoding='utf-8', mode='w') as file:
+        json.dump(state, file)
 
 
 if __name__ == "__main__":
@@ -1,34 +1,141 @@
 """
 Functions for fetching and storing data related to `rec` (appeals) objects
 from `www.contratación.euskadi.eus`
+
+Notes:
+    · Paging the listing with `rows` and `page` has not been checked against the real endpoint, which has been
+    seen returning every REC as a plain list. Pages adding no REC not seen before end the walk.
+    · Once a whole page holds resolutions already seen in the previous run, the rest of them are taken from its
+    REC `.jsonl` file instead of fetched, but only while the listing has been seen sorted from the latest
+    resolution. Otherwise, the whole listing is fetched.
 """
 
 import json
+import logging
 import os
-from datetime import datetime
-
-import requests
+from datetime import date, datetime
 
-from src.transformers.t_utils import del_none
+from src.extractors.e_utils import BASE_URL
+from src.transformers.t_utils import del_none_fast
+from src.utils import log, profiling, retries, telemetry
+from src.utils.utils import get_hash, get_previous_path, reuse_file
 
-SCOPE = 'rec'
-DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', SCOPE)
+SCOPE = 'recs'
 TIME_STAMP = datetime.now().strftime("%Y%m%d")
-REC_URL = "https://www.contratacion.euskadi.eus/y96aResolucionesWar/busqueda/buscarListado?R01HNoPortal=true"
+DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', TIME_STAMP, SCOPE)
+REC_URL = BASE_URL + "y96aResolucionesWar/busqueda/buscarListado?R01HNoPortal=true"
+# Number of RECs asked for in every page of the listing
+REC_PAGE_SIZE = 500
+# Keys identifying a resolution, the hash of the REC is used if none of them is available
+REC_ID_KEYS = ('idResolucion', 'id')
+# Keys and formats of the resolution date, used to check the listing is sorted from the latest resolution
+REC_DATE_KEYS = ('fechaResolucion', 'fecha')
+REC_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+def get_rec_id(rec):
+    for key in REC_ID_KEYS:
+        if rec.get(key) is not None:
+            return str(rec[key])
+    return get_hash(json.dumps(rec, sort_keys=True))[0:25]
+
+
+def get_rec_date(rec):
+    """ Returns the resolution date of a REC, or None if it is missing or has an unknown format """
+    for key in REC_DATE_KEYS:
+        if isinstance(rec.get(key), str):
+            for date_format in REC_DATE_FORMATS:
+                try:
+                    return datetime.strptime(rec[key][:10], date_format).date()
+                except ValueError:
+                    pass
+    return None
+
+
+def iter_rec_pages(page_size=REC_PAGE_SIZE):
+    """ Yields the RECs of every page of the listing, as lists """
+    page, n_pages = 1, 1
+    while page <= n_pages:
+        r_json = retries.request('GET', REC_URL, params={'rows': page_size, 'page': page}).json()
+        if isinstance(r_json, list):
+            # Listing without pagination, every REC is already there
+            yield r_json
+            return
+        n_pages = int(r_json.get('total') or 1)
+        yield r_json['rows']
+        page += 1
+
+
+def iter_jsonl_recs(fpath):
+    """ Yields the id and the line of every REC in a REC `.jsonl` file """
+    with open(fpath, 'r', encoding='utf8') as file:
+        for line in file:
+            yield get_rec_id(json.loads(line)), line
 
 
-def get_rec():
+@log.start_end
+@profiling.profile
+@telemetry.summarize
+def get_recs(path, full=False):
     """
-    Fetches and stores a jsonl file including REC
-    entities (dicts) as in contratacion.euskadi.eus
+    Fetches the RECs page by page and streams them to a REC `.jsonl` file. Unless `full` is True, the listing
+    is walked until a whole page has already been seen in the previous run, whose RECs are reused for the rest,
+    as long as every REC fetched until then came sorted from the latest resolution.
     """
-    rec_list = requests.get(REC_URL).json()
-    filepath = os.path.join(DATA_PATH, '_'.join((TIME_STAMP, SCOPE + '.jsonl')))
-    with open(filepath, 'w', encoding='utf8') as file:
-        for rec in rec_list:
-            file.write(json.dumps(del_none(rec), ensure_ascii=False) + '\n')
+    os.makedirs(path, exist_ok=True)
+    prev_path = get_previous_path(path)
+    prev_fpath = os.path.join(prev_path, 'recs.jsonl') if prev_path else None
+    if full or not prev_fpath or not os.path.isfile(prev_fpath):
+        prev_ids = set()
+    else:
+        prev_ids = {rec_id for rec_id, _ in iter_jsonl_recs(prev_fpath)}
+    seen_ids = set()
+    n_fetched, n_new = 0, 0
+    # Date of the last REC fetched, None once the listing is not known to be sorted from the latest resolution
+    last_date = date.max
+    fpath = os.path.join(path, 'recs.jsonl')
+    try:
+        with open(fpath + '.tmp', 'w', encoding='utf8') as file:
+            for recs in iter_rec_pages():
+                n_page_fetched, n_page_new = 0, 0
+                for rec in recs:
+                    rec = del_none_fast(rec)
+                    if last_date is not None:
+                        rec_date = get_rec_date(rec)
+                        last_date = rec_date if rec_date is not None and rec_date <= last_date else None
+                    rec_id = get_rec_id(rec)
+                    if rec_id in seen_ids:
+                        continue
+                    seen_ids.add(rec_id)
+                    n_page_new += rec_id not in prev_ids
+                    file.write(json.dumps(rec, ensure_ascii=False) + '\n')
+                    n_page_fetched += 1
+                n_fetched += n_page_fetched
+                n_new += n_page_new
+                if not n_page_fetched:
+                    # Either the listing is over or the server ignores paging and keeps sending the same RECs
+                    break
+                if not n_page_new and prev_ids and last_date is not None:
+                    break
+            if prev_ids:
+                # RECs not fetched again are taken from the previous run
+                for rec_id, line in iter_jsonl_recs(prev_fpath):
+                    if rec_id not in seen_ids:
+                        seen_ids.add(rec_id)
+                        file.write(line)
+                        log.count('skips')
+    except (retries.RetryError, KeyError, json.JSONDecodeError) as e:
+        logging.error(f"Could not list RECs: {e!r}")
+        log.count('failures')
+        os.remove(fpath + '.tmp')
+        # Keep the RECs of the previous run, so they are not lost
+        if prev_path and reuse_file('recs.jsonl', prev_path, path):
+            logging.info(f"RECs reused from {prev_path}")
+        return
+    os.replace(fpath + '.tmp', fpath)
+    log.count('records', n_fetched)
+    logging.info(f"RECs stored: {len(seen_ids)}, new since the previous run: {n_new}")
 
 
 if __name__ == "__main__":
-    os.makedirs(DATA_PATH, exist_ok=True)
-    get_rec()
+    get_recs(DATA_PATH)
@@ -4,82 +4,242 @@ Functions for fetching and storing tender announcements (TENDs)
 import json
 import logging
 import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, date
 
-import requests
-
-from src.extractors.e_utils import async_download_urls
-from src.transformers.t_tenders.main import get_tenders_file
-from src.utils import log
-from src.utils.utils import get_hash
+from src.extractors.e_utils import OPENDATA_URL, async_download_urls, iter_downloads_sync
+from src.transformers.t_cache import ParseCache
+from src.transformers.t_dims import get_dims_version
+from src.transformers.t_tenders.main import PARSER_VERSION, get_tender_line, get_tenders_file
+from src.utils import log, profiling, retries, telemetry
+from src.utils.utils import get_hash, get_previous_path, iter_json_array, reuse_file
 
 SCOPE = "tenders"
 
 TIME_STAMP = datetime.now().strftime("%Y%m%d")
+# Format of the `Last-Modified` time naming yearly catalogue files, with minutes after seconds as first stored
+LAST_MODIFIED_FORMAT = "%Y%m%d%H%S%M"
 DATA_PATH = os.path.join(os.getcwd(), '..', '..', 'data', TIME_STAMP, SCOPE)
-YEARLY_TENDERS_URL = "https://opendata.euskadi.eus/contenidos/ds_contrataciones/contrataciones_admin_{year}/opendata/contratos.json"
+YEARLY_TENDERS_URL = OPENDATA_URL + "contenidos/ds_contrataciones/contrataciones_admin_{year}/opendata/contratos.json"
+# Number of yearly files fetched at the same time and size of the chunks they are streamed in
+YEARLY_TENDERS_WORKERS = 8
+CHUNK_SIZE = 256 * 1024
+# File keeping track of the catalogue and tender XMLs stored for every year, used by the next run
+TENDERS_STATE_FNAME = 'raw_xml_tenders_state.json'
+
+
+def get_tenders_state(path):
+    """ Returns the state of the yearly catalogues and tender XMLs stored at `path` """
+    if not path or not os.path.isfile(os.path.join(path, TENDERS_STATE_FNAME)):
+        return {}
+    with open(os.path.join(path, TENDERS_STATE_FNAME), encoding='utf-8', mode='r') as file:
+        return json.load(file)
 
 
-def get_raw_tenders_from_xmls(path):
+def get_tender_xml_plan(path, catalogues=None):
+    """
+    Returns the state of the tender XMLs listed in the yearly catalogues, the paths of the XMLs already
+    available and the requests for the rest, most recent years first. XMLs from the previous run are
+    reused when the year catalogue is unchanged, or when the tender entry in the catalogue is unchanged.
+    `catalogues` maps catalogue filenames to the XMLs already decoded from them while they were fetched.
+    """
+    catalogues = catalogues or {}
     # Data paths
     json_tenders_path = os.path.join(path, 'raw_yearly_tenders')
     xml_tenders_path = os.path.join(path, 'raw_xml_tenders')
     os.makedirs(xml_tenders_path, exist_ok=True)
-    # Iterate through yearly tenders json files
-    rqfpath_list = []
-    for json_fname in os.listdir(json_tenders_path):
-        json_fpath = os.path.join(json_tenders_path, json_fname)
+    prev_path = get_previous_path(path)
+    prev_xml_tenders_path = os.path.join(prev_path, 'raw_xml_tenders') if prev_path else None
+    prev_state = get_tenders_state(prev_path)
+    state = {}
+    # Iterate through yearly tenders json files, named after their year
+    ready_fpaths, rqfpath_list = [], []
+    for json_fname in sorted(os.listdir(json_tenders_path), reverse=True):
+        if not json_fname.endswith('.json'):
+            continue
         tender_year = json_fname.split('_')[0]
-        # Load JSON file and fix malformed files for certain years
-        with open(json_fpath, encoding='utf-8', mode='r') as file:
-            tenders = json.loads(file.read().removesuffix(');').removeprefix('jsonCallback('))
-        # Iterate contracts in file
-        for tender in tenders:
-            try:
-                if tender_year == '2018':
-                    data_xml_url = tender["xetrs89"]
-                else:
-                    data_xml_url = tender["dataXML"]
-            except KeyError:
-                logging.warning(f"Cannot retrieve XML url from {tender}")
-                continue
-            # As contracts do not have a pre-assigned code, create an ID
-            xml_fpath = os.path.join(xml_tenders_path, f"{tender_year}_es_{get_hash(data_xml_url)[0:25]}.xml")
-            # Append url and filepath to the list
-            request_kwargs = {'url': data_xml_url, 'method': 'GET'}
-            rqfpath_list.append((request_kwargs, xml_fpath))
+        prev_xmls = prev_state.get(tender_year, {}).get('xmls', {})
+        if prev_state.get(tender_year, {}).get('catalogue') == json_fname:
+            # Unchanged catalogue, there is no need to decode it again
+            xmls = prev_xmls
+        elif json_fname in catalogues:
+            xmls = catalogues[json_fname]
+        else:
+            # Decode the JSON file incrementally, skipping the `jsonCallback(` wrapper of certain years
+            with open(os.path.join(json_tenders_path, json_fname), encoding='utf-8', mode='r') as file:
+                xmls = dict(get_tender_xmls(iter_json_array(iter(lambda: file.read(CHUNK_SIZE), '')), tender_year))
+        state[tender_year] = {'catalogue': json_fname, 'xmls': xmls}
+        for xml_fname, xml_d in xmls.items():
+            reuse_path = prev_xml_tenders_path if prev_xmls.get(xml_fname) == xml_d else None
+            if reuse_file(xml_fname, reuse_path, xml_tenders_path):
+                ready_fpaths.append(os.path.join(xml_tenders_path, xml_fname))
+            else:
+                request_kwargs = {'url': xml_d['url'], 'method': 'GET'}
+                rqfpath_list.append((request_kwargs, os.path.join(xml_tenders_path, xml_fname)))
+    logging.info(f"Tender XMLs already stored or reused from {prev_path}: {len(ready_fpaths)}")
+    log.count('skips', len(ready_fpaths))
+    return state, ready_fpaths, rqfpath_list
+
+
+def write_tenders_state(path, state):
+    with open(os.path.join(path, TENDERS_STATE_FNAME), encoding='utf-8', mode='w') as file:
+        json.dump(state, file)
+
+
+def get_raw_tenders_from_xmls(path, catalogues=None):
+    """ Fetches and stores the tender XMLs listed in the yearly catalogues """
+    state, _, rqfpath_list = get_tender_xml_plan(path, catalogues)
     async_download_urls(rqfpath_list)
+    write_tenders_state(path, state)
+
+
+@log.start_end
+def get_tenders_pipelined(path, workers=1, cache=True, catalogues=None):
+    """
+    Fetches the tender XMLs listed in the yearly catalogues and parses them into the TENDER `.jsonl` file
+    at the same time: XMLs already available are parsed while the rest are downloaded, and every
+    downloaded XML is handed to a parser worker as soon as it has been stored.
+    Unless `cache` is False, XMLs parsed in previous runs are taken from the parse cache instead.
+    """
+    state, ready_fpaths, rqfpath_list = get_tender_xml_plan(path, catalogues)
+    counts = {'records': 0, 'skips': 0, 'failures': 0}
+    # Parsed results and their cache keys, collected by the main thread as soon as they are available
+    results = queue.SimpleQueue()
+    n_submitted, n_failed_downloads = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1) as executor, \
+            open(os.path.join(path, 'tenders.jsonl'), 'w', encoding='utf-8') as jsonl, \
+            ParseCache(path, 'tenders', f"{PARSER_VERSION}_{get_dims_version()}", enabled=cache) as parse_cache:
+
+        def write_result(status, line):
+            counts[status] += 1
+            if line:
+                jsonl.write(line)
+
+        def parse(xml_fpath):
+            key, result = parse_cache.get_file(xml_fpath)
+            if result is not None:
+                write_result(*result)
+                return 0
+            future = executor.submit(get_tender_line, xml_fpath)
+            future.add_done_callback(lambda f: results.put((key, f)))
+            return 1
+
+        def collect():
+            key, future = results.get()
+            result = future.result()
+            parse_cache.put(key, result)
+            write_result(*result)
+
+        for xml_fpath in ready_fpaths:
+            n_submitted += parse(xml_fpath)
+        for event in iter_downloads_sync(rqfpath_list):
+            if event.status is None or event.status >= 400:
+                n_failed_downloads += 1
+            else:
+                n_submitted += parse(event.fpath)
+            while not results.empty():
+                collect()
+                n_submitted -= 1
+        # Wait for the parsers to finish
+        for _ in range(n_submitted):
+            collect()
+    write_tenders_state(path, state)
+    for counter, n in counts.items():
+        log.count(counter, n)
+    if n_failed_downloads:
+        logging.error(f"Tender XMLs that could not be downloaded: {n_failed_downloads}")
+    logging.info(f"TENDERs parsed: {counts['records']}, skipped: {counts['skips']}, failed: {counts['failures']}")
+
+
+def get_tender_xmls(tenders, tender_year):
+    """ Yields the store filename, url and entry hash of every tender in a yearly tenders file """
+    for tender in tenders:
+        try:
+            if tender_year == '2018':
+                data_xml_url = tender["xetrs89"]
+            else:
+                data_xml_url = tender["dataXML"]
+        except KeyError:
+            logging.warning(f"Cannot retrieve XML url from {tender}")
+            continue
+        # As contracts do not have a pre-assigned code, create an ID
+        xml_fname = f"{tender_year}_es_{get_hash(data_xml_url)[0:25]}.xml"
+        yield xml_fname, {'url': data_xml_url, 'hash': get_hash(json.dumps(tender, sort_keys=True))[0:25]}
+
+
+def get_yearly_tend(path, prev_path, year):
+    """
+    Fetches and stores the `.json` datafile listing the tenders of a given year, reusing the one from the
+    previous run if it has not changed since. Fetched datafiles are decoded while they are streamed to disk,
+    returning their filename and the tender XMLs they list, or None when the datafile is reused.
+    """
+    # Retrieve response headers from `.json` datafile
+    rh = retries.request('HEAD', YEARLY_TENDERS_URL.format(year=year)).headers
+    # Get `Last-Modified` date and `ETag` to name json file after them
+    lastm = datetime.strftime(datetime.strptime(rh["Last-Modified"].split(',')[1], " %d %b %Y %X GMT"),
+                              LAST_MODIFIED_FORMAT)
+    etag = rh['ETag'].replace('"', '')
+    fname = f"{year}_{lastm}_{etag}.json"
+    # Check if file is already there
+    fpath = os.path.join(path, fname)
+    if reuse_file(fname, prev_path, path):
+        log.count('skips')
+        return None
+    # Stream `.json` datafile to disk, so it is never held in memory as a whole, decoding it on the way
+    with retries.request('GET', YEARLY_TENDERS_URL.format(year=year), stream=True) as r:
+        r.encoding = 'utf-8'
+        with open(fpath + '.part', mode="w", encoding='utf-8') as file:
+
+            def tee(chunks):
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+
+            chunks = tee(r.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=True))
+            xmls = dict(get_tender_xmls(iter_json_array(chunks), str(year)))
+            # Store whatever follows the array, such as the closing of the `jsonCallback(...)` wrapper
+            for _ in chunks:
+                pass
+    os.replace(fpath + '.part', fpath)
+    log.count('downloads')
+    log.count('bytes', os.path.getsize(fpath))
+    logging.info(f"File '{fname}' fetched and stored.")
+    return fname, xmls
 
 
 @log.start_end
 def get_yearly_tends(path, start_year, end_year=date.today().year + 1):
+    """ Fetches the yearly tender datafiles, returning the tender XMLs decoded from the fetched ones by filename """
+    prev_path = get_previous_path(path)
+    prev_path = os.path.join(prev_path, 'raw_yearly_tenders') if prev_path else None
     path = os.path.join(path, 'raw_yearly_tenders')
     os.makedirs(path, exist_ok=True)
-    for year in range(start_year, end_year):
-        # Retrieve response headers from `.json` datafile
-        rh = requests.head(YEARLY_TENDERS_URL.format(year=year)).headers
-        # Get `Last-Modified` date and `ETag` to name json file after them
-        lastm = datetime.strftime(datetime.strptime(rh["Last-Modified"].split(',')[1], " %d %b %Y %X GMT"),
-                                  "%Y%m%d%H%S%M")
-        etag = rh['ETag'].replace('"', '')
-        fname = f"{year}_{lastm}_{etag}.json"
-        # Check if file is already there
-        fpath = os.path.join(path, fname)
-        if os.path.isfile(fpath):
-            continue
-        # Download and store `.json` datafile
-        r = requests.get(YEARLY_TENDERS_URL.format(year=year))
-        with open(fpath, mode="w", encoding='utf-8') as file:
-            file.write(r.content.decode('utf-8'))
-        logging.info(f"File '{fname}' fetched and stored.")
+    with ThreadPoolExecutor(max_workers=YEARLY_TENDERS_WORKERS) as executor:
+        # Consume results so exceptions raised while fetching are not silenced
+        return dict(filter(None, executor.map(lambda year: get_yearly_tend(path, prev_path, year),
+                                              range(start_year, end_year))))
 
 
 @log.start_end
-def get_tenders(path):
+@profiling.profile
+@telemetry.summarize
+def get_tenders(path, extract=True, transform=True, start_year=2015, end_year=None, workers=1, pipelined=True,
+                cache=True):
+    """
+    Fetches and transforms the tenders of years from `start_year` to `end_year` (included, current year if None).
+    When both fetching and transforming, tender XMLs are parsed while they are downloaded unless `pipelined` is False.
+    Unless `cache` is False, tender XMLs parsed in previous runs are not parsed again.
+    """
     os.makedirs(path, exist_ok=True)
-    get_yearly_tends(path, start_year=2015)
-    get_raw_tenders_from_xmls(path)
-    get_tenders_file(path)
+    if extract:
+        catalogues = get_yearly_tends(path, start_year=start_year, end_year=(end_year or date.today().year) + 1)
+        if transform and pipelined:
+            get_tenders_pipelined(path, workers=workers, cache=cache, catalogues=catalogues)
+            return
+        get_raw_tenders_from_xmls(path, catalogues)
+    if transform:
+        get_tenders_file(path, workers=workers, cache=cache)
 
 
 if __name__ == "__main__":
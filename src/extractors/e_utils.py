@@ -1,73 +1,212 @@
 import asyncio
 import logging
+import os
+import queue
 import sys
-from asyncio import Semaphore
-from typing import IO
+import threading
+import time
+from asyncio import Queue
+from collections import namedtuple
 
 import aiofile
 import aiohttp
 from aiohttp import ClientSession, ClientTimeout
 
+from src.utils import log, retries, telemetry
 
-async def get_html(session: ClientSession, **kwargs) -> str:
-    resp = await session.request(**kwargs)
-    resp.raise_for_status()
-    html = resp.text()
-    return await html
+# Base URLs of the remote servers, which can be overridden to run the extractors against a different host
+BASE_URL = os.environ.get('KONTRATAZIOA_BASE_URL', "https://www.contratacion.euskadi.eus/")
+OPENDATA_URL = os.environ.get('KONTRATAZIOA_OPENDATA_URL', "https://opendata.euskadi.eus/")
+# Maximum number of requests sent at the same time by `async_download_urls`
+DOWNLOAD_CONCURRENCY = 100
 
+# Outcome of a download: the file path, the last response status (if any) and the number of bytes stored
+DownloadEvent = namedtuple('DownloadEvent', ('fpath', 'status', 'n_bytes'))
 
-async def fetch_html(session: ClientSession, **kwargs) -> str:
-    attempt = 1
-    times = 5
-    while attempt < times + 1:
+
+async def get_html(session: ClientSession, **kwargs) -> (int, str):
+    start = time.perf_counter()
+    async with session.request(**kwargs) as resp:
+        body = await resp.read()
+        telemetry.record(kwargs['url'], time.perf_counter() - start, resp.status, len(body))
+        resp.raise_for_status()
+        return resp.status, body.decode(resp.get_encoding())
+
+
+async def fetch_html(session: ClientSession, attempts=retries.ATTEMPTS, **kwargs) -> (int, str):
+    """
+    Returns the status and body of the response, retrying timeouts, connection errors and `RETRY_STATUSES`
+    responses as set by the retry policy. Raises `RetryError` once every attempt failed.
+    """
+    url = kwargs['url']
+    for attempt in range(1, attempts + 1):
+        await retries.async_sleep_host_pause(url)
+        start = time.perf_counter()
+        headers = None
         try:
-            html = await get_html(session, **kwargs)
+            status_html = await get_html(session, **kwargs)
+        except asyncio.exceptions.TimeoutError as e:
+            # Also raised by aiohttp socket timeouts, which are `ClientError` too
+            telemetry.record_timeout(url, time.perf_counter() - start)
+            error = e
+        except aiohttp.ClientResponseError as e:
+            if e.status not in retries.RETRY_STATUSES:
+                raise
+            error, headers = e, e.headers
         except (
                 aiohttp.ClientError,
                 aiohttp.http_exceptions.HttpProcessingError,
         ) as e:
-            message = getattr(e, 'message', None)
-            status = getattr(e, 'status', None)
-            if status != 404:
-                attempt += 1
-            else:
-                logging.warning(f"aiohttp exception for {kwargs} [{status}]: {message}")
-                return
-        except asyncio.exceptions.TimeoutError as e:
-            attempt += 1
-            logging.warning(f"Non-aiohttp exception occured:  {getattr(e, '__dict__', {})}")
-        except Exception as e:
-            logging.warning(f"Non-aiohttp exception occured:  {getattr(e, '__dict__', {})}")
-            return
+            # Errors with no response, such as dropped connections
+            telemetry.record(url, time.perf_counter() - start, type(e).__name__)
+            error = e
+        else:
+            retries.record_success(url)
+            return status_html
+        if attempt < attempts:
+            await asyncio.sleep(retries.get_retry_delay(url, attempt, headers))
+        else:
+            retries.record_failure(url)
+    raise retries.RetryError(f"{kwargs.get('method')} {url} failed after {attempts} attempts: {error!r}") from error
+
+
+async def write_one(session: ClientSession, request_kwargs: dict, fpath: str) -> DownloadEvent:
+    """ Stores the response body in `fpath`, returning the outcome of the download """
+    try:
+        status, html = await fetch_html(session, **request_kwargs)
+    except Exception as e:
+        logging.warning(f"Could not fetch {request_kwargs.get('url')} into {fpath}: {type(e).__name__} {e}")
+        log.count('failures')
+        # Status of the last response, if there was any
+        return DownloadEvent(fpath, getattr(e, 'status', getattr(e.__cause__, 'status', None)), 0)
+    async with aiofile.AIOFile(fpath, 'w') as fl:
+        await fl.write(html)
+    n_bytes = len(html.encode('utf8'))
+    log.count('downloads')
+    log.count('bytes', n_bytes)
+    return DownloadEvent(fpath, status, n_bytes)
+
+
+async def produce(urls_fpaths, tasks: Queue, n_workers: int):
+    """
+    Feeds the tasks queue from an iterable or an async iterable, then tells every worker to stop,
+    also if the iterable raises
+    """
+    try:
+        if hasattr(urls_fpaths, '__aiter__'):
+            async for request_kwargs, fpath in urls_fpaths:
+                await tasks.put((request_kwargs, fpath))
         else:
-            return html
-    logging.warning(f'Unable to succesfully get {kwargs} after {times}. [{status}]: {message}')
-    return
+            for request_kwargs, fpath in urls_fpaths:
+                await tasks.put((request_kwargs, fpath))
+    finally:
+        for _ in range(n_workers):
+            await tasks.put(None)
 
 
-async def write_one(file: IO, sem: Semaphore, **kwargs) -> None:
-    async with sem:
-        html = await fetch_html(**kwargs)
-        if not html:
-            return None
-        async with aiofile.AIOFile(file, 'w') as fl:
-            await fl.write(html)
+async def work(session: ClientSession, tasks: Queue, events: Queue):
+    """ Downloads tasks until told to stop, then tells the consumer it stopped, also if a download raises """
+    try:
+        while (task := await tasks.get()) is not None:
+            await events.put(await write_one(session, *task))
+    finally:
+        await events.put(None)
 
 
-async def manage_tasks(urls_fpaths):
+async def iter_downloads(urls_fpaths, concurrency=None):
+    """
+    Downloads every (request kwargs, file path) pair of `urls_fpaths`, an iterable or async iterable,
+    with a fixed pool of `concurrency` workers fed through a bounded queue. Yields a `DownloadEvent`
+    as soon as every download finishes, so files can be processed while the rest are downloaded.
+    """
+    concurrency = concurrency or DOWNLOAD_CONCURRENCY
     timeout = ClientTimeout(total=600)
-    connector = aiohttp.TCPConnector(limit=100, force_close=True)
-    sem = Semaphore(100)
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=True)
+    tasks, events = Queue(maxsize=2 * concurrency), Queue(maxsize=2 * concurrency)
     async with ClientSession(connector=connector, timeout=timeout) as session:
-        tasks = []
-        for request_kwargs, fpath in urls_fpaths:
-            tasks.append(write_one(file=fpath, session=session, sem=sem, **request_kwargs))
-        await asyncio.gather(*tasks)
-    return
+        running = [asyncio.create_task(produce(urls_fpaths, tasks, concurrency))]
+        running += [asyncio.create_task(work(session, tasks, events)) for _ in range(concurrency)]
+        get_event = None
+        try:
+            n_running_workers = concurrency
+            while n_running_workers:
+                get_event = get_event or asyncio.create_task(events.get())
+                done, _ = await asyncio.wait([get_event, *running], return_when=asyncio.FIRST_COMPLETED)
+                # Surface exceptions raised while producing tasks or downloading, cancelling the rest
+                for task in done:
+                    if task is not get_event and task.exception() is not None:
+                        raise task.exception()
+                running = [task for task in running if not task.done()]
+                if get_event.done():
+                    event, get_event = get_event.result(), None
+                    if event is None:
+                        n_running_workers -= 1
+                    else:
+                        yield event
+            await asyncio.gather(*running)
+        finally:
+            for task in running + [get_event]:
+                if task is not None:
+                    task.cancel()
 
 
-def async_download_urls(urls_fpaths):
-    logging.info(f"Number of objects to be downloaded: {len(urls_fpaths)}")
+def set_event_loop_policy():
     if sys.version_info[0] == 3 and sys.version_info[1] >= 8 and sys.platform.startswith('win'):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(manage_tasks(urls_fpaths))
+
+
+def iter_downloads_sync(urls_fpaths, concurrency=None):
+    """
+    Synchronous version of `iter_downloads`, running the downloads in a background thread.
+    Downloads are paused while the caller has not consumed the events already available.
+    """
+    events = queue.Queue(maxsize=2 * (concurrency or DOWNLOAD_CONCURRENCY))
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the caller stopped consuming events
+        while not stop.is_set():
+            try:
+                return events.put(item, timeout=0.5)
+            except queue.Full:
+                continue
+
+    async def consume():
+        async for event in iter_downloads(urls_fpaths, concurrency):
+            await asyncio.to_thread(put, event)
+            if stop.is_set():
+                return
+
+    def run():
+        try:
+            set_event_loop_policy()
+            asyncio.run(consume())
+        except BaseException as e:
+            put(e)
+        finally:
+            put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while (event := events.get()) is not None:
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+    finally:
+        stop.set()
+        thread.join()
+
+
+def async_download_urls(urls_fpaths, concurrency=None):
+    """ Downloads every (request kwargs, file path) pair, returning the paths that could not be downloaded """
+    failed_fpaths = []
+    n_downloads = 0
+    for event in iter_downloads_sync(urls_fpaths, concurrency):
+        n_downloads += 1
+        if event.status is None or event.status >= 400:
+            failed_fpaths.append(event.fpath)
+    logging.info(f"Number of objects downloaded: {n_downloads - len(failed_fpaths)}")
+    if failed_fpaths:
+        logging.error(f"Number of objects that could not be downloaded: {len(failed_fpaths)}")
+    return failed_fpaths
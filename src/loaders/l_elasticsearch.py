@@ -1,11 +1,14 @@
 import configparser
 import json
+import logging
 import os
 from ssl import create_default_context
 
 import elasticsearch.helpers
 from elasticsearch import Elasticsearch
 
+from src.utils import log, profiling
+
 
 def document_stream(path, index_name):
     with open(path, "r", encoding='utf-8') as jsonl:
@@ -13,11 +16,29 @@ def document_stream(path, index_name):
             yield {"_index": index_name, "_source": json.loads(doc)}
 
 
-def stream_bulk(es, fpath, index_name):
+def stream_bulk(es, fpath, index_name, chunk_size=500, thread_count=1, raise_on_error=True):
+    """
+    Indexes every doc of a `.jsonl` file in chunks of `chunk_size` docs, sending
+    `thread_count` chunks at a time. Returns the number of indexed and failed docs.
+    Raises `BulkIndexError` on the first rejected doc unless `raise_on_error` is False.
+    """
     stream = document_stream(fpath, index_name)
-    for ok, response in elasticsearch.helpers.streaming_bulk(es, actions=stream):
-        if not ok:
-            print(response)
+    if thread_count > 1:
+        responses = elasticsearch.helpers.parallel_bulk(es, actions=stream, thread_count=thread_count,
+                                                        chunk_size=chunk_size, raise_on_error=raise_on_error)
+    else:
+        responses = elasticsearch.helpers.streaming_bulk(es, actions=stream, chunk_size=chunk_size,
+                                                         raise_on_error=raise_on_error)
+    n_ok, n_failed = 0, 0
+    for ok, response in responses:
+        if ok:
+            n_ok += 1
+        else:
+            n_failed += 1
+            logging.warning(f"Could not index doc in {index_name}: {response}")
+    log.count('records', n_ok)
+    log.count('failures', n_failed)
+    return n_ok, n_failed
 
 
 def connect_to_es(secrets_path):
@@ -37,7 +58,11 @@ def connect_to_es(secrets_path):
     return es_session
 
 
-def load_in_es(jsonl_list, secrets_path):
+@log.start_end
+@profiling.profile
+def load_in_es(jsonl_list, secrets_path, chunk_size=500, thread_count=1):
     es = connect_to_es(secrets_path)
     for jsonl_path, idx_name in jsonl_list:
-        stream_bulk(es, jsonl_path, idx_name)
+        with log.span(f"load_{idx_name}"):
+            n_ok, n_failed = stream_bulk(es, jsonl_path, idx_name, chunk_size=chunk_size, thread_count=thread_count)
+        logging.info(f"Docs indexed in {idx_name}: {n_ok}, failed: {n_failed}")
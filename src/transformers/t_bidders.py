@@ -6,37 +6,58 @@ import json
 import logging
 import os
 
+from src.transformers.t_cache import ParseCache
+from src.transformers.t_records import Record
+from src.utils import log
 from src.utils.utils import flatten
 
+# Version of the CBIDDER parser, to be bumped whenever its output changes, invalidating cached results
+PARSER_VERSION = 1
 
-def get_cbidders_dict(path):
-    """ Parses and cleans CBIDDER `json` data and stores it in a dict """
-    cbidders_d = {}
+
+class BidderRecord(Record):
+    """ BIDDER fields, as taken from CONTs or from CBIDDER `json` files """
+    __slots__ = ('name', 'purpose', 'location_nuts', 'location_address', 'location_municipalty', 'list_iae',
+                 'list_serobr', 'is_overdue_certificate', 'is_classified_bidder')
+    CATEGORICAL = ('location_nuts', 'location_municipalty', 'list_iae', 'list_serobr')
+
+
+def get_cbidders_dict(path, cache=True):
+    """ Parses and cleans CBIDDER `json` data and stores it in a dict of `BidderRecord` """
     raw_cbidders_path = os.path.join(path, "raw_cbidders_jsons")
+    json_fpaths = [os.path.join(raw_cbidders_path, json_fname) for json_fname in os.listdir(raw_cbidders_path)]
     # Iterating through every CBIDDER json
-    for json_fname in os.listdir(raw_cbidders_path):
-        with open(os.path.join(raw_cbidders_path, json_fname), 'r', encoding='utf8') as jsonf:
-            try:
-                b_dict = json.load(jsonf)
-            except json.JSONDecodeError as e:
-                logging.warning(f'{e}. Could not decode {json_fname}')
-                continue
-        cbidders_d[b_dict["cif"]] = {
-            "name": b_dict.get("denominacionSocial"),
-            "purpose": b_dict.get("objeto"),
-            "location_nuts": parse_nuts(b_dict),
-            "location_address": b_dict.get("direccion"),
-            "location_municipalty": b_dict.get("municipioDes"),
-            "list_iae": parse_list_cpv(b_dict),
-            "list_serobr": parse_list_serobr(b_dict),
-            "is_overdue_certificate": b_dict.get("certificadoCaducado"),
-            "is_classified_bidder": True,
-            # "n_emp": b_dict.get("nEmp"),
-            # "n_insc": b_dict.get("nInsc"),
-        }
+    with ParseCache(path, 'cbidders', PARSER_VERSION, enabled=cache) as parse_cache:
+        cbidders_d = {cif: BidderRecord(**cbidder_d)
+                      for cif, cbidder_d in filter(None, parse_cache.map(get_cbidder, json_fpaths))}
+    log.count('records', len(cbidders_d))
     return cbidders_d
 
 
+def get_cbidder(json_fpath):
+    """ Returns the CIF and the clean data of a CBIDDER `json` file, or None if it cannot be decoded """
+    with open(json_fpath, 'r', encoding='utf8') as jsonf:
+        try:
+            b_dict = json.load(jsonf)
+        except json.JSONDecodeError as e:
+            logging.warning(f'{e}. Could not decode {os.path.basename(json_fpath)}')
+            log.count('failures')
+            return None
+    return b_dict["cif"], {
+        "name": b_dict.get("denominacionSocial"),
+        "purpose": b_dict.get("objeto"),
+        "location_nuts": parse_nuts(b_dict),
+        "location_address": b_dict.get("direccion"),
+        "location_municipalty": b_dict.get("municipioDes"),
+        "list_iae": parse_list_cpv(b_dict),
+        "list_serobr": parse_list_serobr(b_dict),
+        "is_overdue_certificate": b_dict.get("certificadoCaducado"),
+        "is_classified_bidder": True,
+        # "n_emp": b_dict.get("nEmp"),
+        # "n_insc": b_dict.get("nInsc"),
+    }
+
+
 ALIAS_NUTS = {'La Coruña': 'ES111', 'Coruña, A': 'ES111', 'Lugo': 'ES112', 'Orense': 'ES113', 'Ourense': 'ES113',
               'Pontevedra': 'ES114', 'Principado de Asturias': 'ES120', 'Asturias': 'ES120', 'Cantabria': 'ES130',
               'Álava': 'ES211', 'Guipúzcoa': 'ES212', 'Gipuzkoa': 'ES212', 'Vizcaya': 'ES213', 'Bizkaia': 'ES213',
@@ -0,0 +1,137 @@
+"""
+Persistent cache of parse results, so transformers only parse raw files that changed
+
+Results are keyed by the raw file name and content hash, and stored along with the version
+of the parser that produced them. Every transformer declares a `PARSER_VERSION`, to be bumped
+whenever its output changes, and those using dimensions add the version of the dimensions fetched
+(`t_dims.get_dims_version`): results stored by other versions are dropped when the cache is opened.
+Results of raw files not looked up by a run, such as older versions of files whose content changed,
+are dropped when the cache is closed, unless the run failed.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_FNAME = 'parse_cache.sqlite'
+# Number of stored results between commits
+COMMIT_EVERY = 1000
+
+
+def get_cache_fpath(path):
+    """ Given a `data/<YYYYMMDD>/<scope>` path, returns the cache path, shared by every run, in `data` """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(path))), CACHE_FNAME)
+
+
+def get_file_key(fpath):
+    """ Returns a key identifying the name and content of a raw file """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(os.path.basename(fpath).encode('utf8'))
+    with open(fpath, mode='rb') as file:
+        h.update(file.read())
+    return h.hexdigest()
+
+
+class ParseCache:
+    """ Parse results of a scope, as JSON values. Used as a context manager, it is a no-op when not `enabled` """
+
+    def __init__(self, path, scope, parser_version, enabled=True):
+        self.scope = scope
+        self.parser_version = str(parser_version)
+        self.enabled = enabled
+        self.hits, self.misses = 0, 0
+        # Keys looked up or stored by this run, the rest of the scope is dropped on exit
+        self.used_keys = set()
+        self.pending = 0
+        self.db = None
+        self.db_fpath = get_cache_fpath(path)
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        self.db = sqlite3.connect(self.db_fpath)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                        "scope TEXT, key TEXT, parser_version TEXT, result TEXT, PRIMARY KEY (scope, key))")
+        # Results of other parser versions will never be used again
+        self.db.execute("DELETE FROM results WHERE scope = ? AND parser_version != ?",
+                        (self.scope, self.parser_version))
+        self.db.commit()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.db is None:
+            return
+        if exc_type is None:
+            self.prune()
+        self.db.commit()
+        self.db.close()
+        self.db = None
+        logging.info(f"Parse cache for {self.scope}: {self.hits} hits, {self.misses} misses")
+
+    def prune(self):
+        """ Drops the results of the scope whose keys have not been used by this run """
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS used_keys (key TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM used_keys")
+        self.db.executemany("INSERT OR IGNORE INTO used_keys VALUES (?)", ((key,) for key in self.used_keys))
+        n_pruned = self.db.execute("DELETE FROM results WHERE scope = ? AND key NOT IN (SELECT key FROM used_keys)",
+                                   (self.scope,)).rowcount
+        if n_pruned:
+            logging.info(f"Parse cache for {self.scope}: {n_pruned} unused results dropped")
+
+    def get(self, key):
+        """ Returns the stored result for `key`, or None """
+        if self.db is None:
+            return None
+        self.used_keys.add(key)
+        row = self.db.execute("SELECT result FROM results WHERE scope = ? AND key = ? AND parser_version = ?",
+                              (self.scope, key, self.parser_version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """ Stores the result for `key`. None results are not stored, so failed files are parsed again """
+        if self.db is None or result is None:
+            return
+        self.used_keys.add(key)
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                        (self.scope, key, self.parser_version, json.dumps(result, ensure_ascii=False)))
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.db.commit()
+            self.pending = 0
+
+    def get_file(self, fpath):
+        """ Returns the key of a raw file and its stored result, or None """
+        if self.db is None:
+            return None, None
+        key = get_file_key(fpath)
+        return key, self.get(key)
+
+    def map(self, func, fpaths, workers=1, chunksize=8):
+        """
+        Yields `func(fpath)` for every raw file in `fpaths`, taking the results of unchanged files
+        from the cache. The rest are parsed in `workers` processes if more than one, and stored.
+        """
+        misses = []
+        for fpath in fpaths:
+            key, result = self.get_file(fpath)
+            if result is None:
+                misses.append((fpath, key))
+            else:
+                yield result
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(func, [fpath for fpath, _ in misses], chunksize=chunksize)
+                for (fpath, key), result in zip(misses, results):
+                    self.put(key, result)
+                    yield result
+        else:
+            for fpath, key in misses:
+                result = func(fpath)
+                self.put(key, result)
+                yield result
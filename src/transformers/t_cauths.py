@@ -11,47 +11,69 @@ import os
 
 from bs4 import BeautifulSoup
 
+from src.transformers.t_cache import ParseCache
 from src.utils import log
 
+# Version of the cauth parsers, to be bumped whenever their output changes, invalidating cached results
+PARSER_VERSION = 1
+
 
 @log.start_end
-def get_cauths_file(path, cauths_dict):
+def get_cauths_file(path, cauths_dict, cache=True):
     """
     Based on raw html data, generates a cauth
     consolidated jsonl file at DATA_PATH
     """
     cfilename = os.path.join(path, 'cauths.jsonl')
-    with open(cfilename, mode='w', encoding='utf8') as cfile:
-        raw_data_path = os.path.join(path, 'raw_html')
-        for filename in os.listdir(raw_data_path):
-            # Open raw html content
-            with open(os.path.join(raw_data_path, filename), mode='r', encoding='ISO-8859-1') as file:
-                html_file = file.read()
-            # Get just the data part
-            soup = BeautifulSoup(html_file, 'html.parser')
-            html_data = soup.find(id='containerkpe_cont_kpeperfi')
-            if not html_data:
-                logging.info(f"No data in {filename}")
+    raw_data_path = os.path.join(path, 'raw_html')
+    fpaths = [os.path.join(raw_data_path, filename) for filename in os.listdir(raw_data_path)]
+    n_cauths, n_skipped = 0, 0
+    with open(cfilename, mode='w', encoding='utf8') as cfile, \
+            ParseCache(path, 'cauths', PARSER_VERSION, enabled=cache) as parse_cache:
+        for cauth_d in parse_cache.map(get_cauth_d, fpaths):
+            if not cauth_d:
+                n_skipped += 1
                 continue
-            # Construct a cauth dict with parsed data
-            cauth_d = {}
-            parse_filename(filename, cauth_d, cauths_dict)
-            parsers = [
-                parse_url_official,
-                parse_url_logo,
-                parse_date_published,
-                parse_title_nif,
-                parse_name_nif,
-                parse_location_nuts,
-                parse_location_address,
-                parse_type_authority,
-                parse_type_main_activity,
-                parse_list_promoters,
-                # parse_location_ambito,
-            ]
-            for func in parsers:
-                func(html_data, cauth_d)
+            # Names are not in the html files, so they are not cached along with the parsed data
+            cauth_d = {'cod_perfil': cauth_d['cod_perfil'],
+                       'name': cauths_dict[cauth_d['cod_perfil']]["nombreCortoEs"]} | cauth_d
             cfile.write(json.dumps(cauth_d, ensure_ascii=False) + '\n')
+            n_cauths += 1
+    log.count('records', n_cauths)
+    log.count('skips', n_skipped)
+
+
+def get_cauth_d(fpath):
+    """ Returns a cauth dict with the data parsed from a raw html file, empty if it has no data """
+    filename = os.path.basename(fpath)
+    # Open raw html content
+    with open(fpath, mode='r', encoding='ISO-8859-1') as file:
+        html_file = file.read()
+    # Get just the data part
+    soup = BeautifulSoup(html_file, 'html.parser')
+    html_data = soup.find(id='containerkpe_cont_kpeperfi')
+    if not html_data:
+        logging.info(f"No data in {filename}")
+        return {}
+    # Construct a cauth dict with parsed data
+    cauth_d = {}
+    parse_filename(filename, cauth_d)
+    parsers = [
+        parse_url_official,
+        parse_url_logo,
+        parse_date_published,
+        parse_title_nif,
+        parse_name_nif,
+        parse_location_nuts,
+        parse_location_address,
+        parse_type_authority,
+        parse_type_main_activity,
+        parse_list_promoters,
+        # parse_location_ambito,
+    ]
+    for func in parsers:
+        func(html_data, cauth_d)
+    return cauth_d
 
 
 def parse_title_nif(soup, cauth_d):
@@ -220,12 +242,11 @@ def parse_type_authority(soup, cauth_d: dict):
     cauth_d["type_authority"] = container.parent.parent.find("div", class_="r01SeccionTexto").string
 
 
-def parse_filename(filename: str, cauth_d: dict, cauths_dict: dict):
-    """ Adds (`cod_perfil`, `name`, `cauth_version`, `url_kontratazioa`) key(s) to cauth dict """
+def parse_filename(filename: str, cauth_d: dict):
+    """ Adds (`cod_perfil`, `cauth_version`, `url_kontratazioa`) key(s) to cauth dict """
     filename = filename.removesuffix(".html")
     version, cod_perfil = filename.split('_')
     cauth_d["cod_perfil"] = cod_perfil
-    cauth_d["name"] = cauths_dict[cod_perfil]["nombreCortoEs"]
     if version == "v1":
         cauth_d["cauth_version"] = "v1"
         cauth_d["url_kontratazioa"] = \
@@ -5,8 +5,13 @@ import xml.etree.ElementTree as ET
 from datetime import datetime
 
 import src.transformers.t_utils as utils
+from src.transformers.t_cache import ParseCache
+from src.transformers.t_dims import get_cpv_levels, get_dims_version, get_nuts_levels
 from src.utils import log
 
+# Version of the CONT parser, to be bumped whenever its output changes, invalidating cached results
+PARSER_VERSION = 1
+
 # Fields from the `.xml` document that may contain array-ed elements
 XML_LIST_FIELDS = (
     'publicacionesBOTH', 'modificacionesIncidencia', 'publicacionesBOE',
@@ -48,25 +53,40 @@ CONT_KNOWN_KEYS = (
 
 
 @log.start_end
-def get_conts_file(path):
-    """ Parses and cleans raw CONT `.xml` data and stores it in a CONT `.jsonl` file """
+def get_conts_file(path, workers=1, cache=True):
+    """
+    Parses and cleans raw CONT `.xml` data and stores it in a CONT `.jsonl` file.
+    With more than one worker, `.xml` files are parsed in that many processes.
+    Unless `cache` is False, only `.xml` files not parsed in previous runs are parsed.
+    """
     jsonl_path = os.path.join(path, "conts.jsonl")
-    with open(jsonl_path, 'w', encoding='utf-8') as jsonl:
-        raw_cauth_conts_path = os.path.join(path, 'raw_cauth_conts')
-        # Iterating through every CONT xml
-        for xml_fname in os.listdir(raw_cauth_conts_path):
-            cauth_cod_perfil, od_report_year, od_report_id, od_report_date_modified = xml_fname.removesuffix(
-                '.xml').split('_')
-            od_report_date_modified = datetime.strptime(od_report_date_modified, "%Y%m%d").strftime("%Y/%m/%d")
-            cont_d = {'open_data_report': {'id': od_report_id,
-                                           'year': od_report_year,
-                                           'date_modified': od_report_date_modified},
-                      'cauth_cod_perfil': str(int(cauth_cod_perfil))}
-            # Iterating through every CONT in a given `.xml` file
-            for xml_cont_node in ET.parse(os.path.join(raw_cauth_conts_path, xml_fname)).getroot():
-                parsed_cont_d = parse_xml_cont_node(xml_cont_node)
-                full_cont_d = dict(cont_d, **parsed_cont_d)
-                jsonl.write(json.dumps(full_cont_d, ensure_ascii=False) + '\n')
+    raw_cauth_conts_path = os.path.join(path, 'raw_cauth_conts')
+    xml_fpaths = [os.path.join(raw_cauth_conts_path, xml_fname) for xml_fname in os.listdir(raw_cauth_conts_path)]
+    n_conts = 0
+    with open(jsonl_path, 'w', encoding='utf-8') as jsonl, \
+            ParseCache(path, 'conts', f"{PARSER_VERSION}_{get_dims_version()}", enabled=cache) as parse_cache:
+        for lines in parse_cache.map(get_cont_lines, xml_fpaths, workers, chunksize=8):
+            jsonl.writelines(lines)
+            n_conts += len(lines)
+    log.count('records', n_conts)
+
+
+def get_cont_lines(xml_fpath):
+    """ Returns the `.jsonl` lines of every CONT in a CONT `.xml` file """
+    cauth_cod_perfil, od_report_year, od_report_id, od_report_date_modified = os.path.basename(
+        xml_fpath).removesuffix('.xml').split('_')
+    od_report_date_modified = datetime.strptime(od_report_date_modified, "%Y%m%d").strftime("%Y/%m/%d")
+    cont_d = {'open_data_report': {'id': od_report_id,
+                                   'year': od_report_year,
+                                   'date_modified': od_report_date_modified},
+              'cauth_cod_perfil': str(int(cauth_cod_perfil))}
+    lines = []
+    # Iterating through every CONT in a given `.xml` file
+    for xml_cont_node in ET.parse(xml_fpath).getroot():
+        parsed_cont_d = parse_xml_cont_node(xml_cont_node)
+        full_cont_d = dict(cont_d, **parsed_cont_d)
+        lines.append(json.dumps(full_cont_d, ensure_ascii=False) + '\n')
+    return lines
 
 
 def parse_xml_cont_node(xml_cont_node):
@@ -78,7 +98,7 @@ def parse_xml_cont_node(xml_cont_node):
     )
     utils.check_no_matched_key(parsed_cont_d, CONT_KNOWN_KEYS)
     cont_d = get_clean_cont(parsed_cont_d)
-    return cont_d
+    return cont_d | get_cpv_levels(cont_d["cpv"]) | get_nuts_levels(cont_d["location_nuts"])
 
 
 def get_clean_cont(cont_d):
@@ -0,0 +1,113 @@
+"""
+Functions for enriching entities with hierarchy levels taken from the dimension tables at `meta/`,
+updated with the dimensions fetched by `e_dims.get_dims` into `DIMS_PATH`
+
+Tables are loaded once per process and exposed as read-only mappings, so transformers can
+call the lookups below for every record without re-reading any file.
+
+Notes:
+    · `meta/` only ships the supplementary CPV vocabulary, so CPV levels are derived from the
+    tree structure of the main vocabulary codes (XX000000-Y, XXX00000-Y, XXXX0000-Y).
+    · The level of a NUTS code is its length minus the two letters of the country, so the codes
+    of the fetched `nuts` dimension are added to the `meta/` table without needing its other fields.
+"""
+import csv
+import json
+import os
+from functools import lru_cache
+from types import MappingProxyType
+
+META_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'meta')
+NUTS_FNAME = 'std_nuts-2021.csv'
+# Directory the dimensions are fetched into, shared by every operation date
+DIMS_PATH = os.path.join(os.getcwd(), 'data', 'dimensions')
+# File keeping track of the dimensions stored, used by the next fetch
+DIMS_STATE_FNAME = 'dims_state.json'
+# Keys holding the code of a fetched NUTS row, the first one available is used
+NUTS_CODE_KEYS = ('codigo', 'codNuts', 'nuts_id', 'id')
+
+# Number of leading digits that identify every level of the CPV main vocabulary
+CPV_LEVELS = (('cpv_division', 2), ('cpv_group', 3), ('cpv_class', 4))
+
+
+def read_meta_csv(fname):
+    """ Yields every row of a `meta/` csv file as a dict """
+    with open(os.path.join(META_PATH, fname), mode='r', encoding='utf8', newline='') as file:
+        yield from csv.DictReader(file, delimiter=';')
+
+
+def get_dims_state(path=None):
+    """ Returns the fetch time, content hash and file name of every dimension stored at `path` (or `DIMS_PATH`) """
+    path = path or DIMS_PATH
+    if not os.path.isfile(os.path.join(path, DIMS_STATE_FNAME)):
+        return {}
+    with open(os.path.join(path, DIMS_STATE_FNAME), encoding='utf-8', mode='r') as file:
+        return json.load(file)
+
+
+def read_dim_jsonl(name, path=None):
+    """ Yields every row of the `name` dimension stored at `path` (or `DIMS_PATH`), if any, as a dict """
+    path = path or DIMS_PATH
+    dim = get_dims_state(path).get(name)
+    if not dim or not os.path.isfile(os.path.join(path, dim['fname'])):
+        return
+    with open(os.path.join(path, dim['fname']), mode='r', encoding='utf8') as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def get_dims_version(path=None):
+    """ Returns a value identifying the dimensions used by transformers, to tell parse caches when they change """
+    return get_dims_state(path).get('nuts', {}).get('hash', 'meta')[0:12]
+
+
+def get_nuts_code(row):
+    code = next((row[key] for key in NUTS_CODE_KEYS if row.get(key)), None)
+    if isinstance(code, str) and 2 <= len(code.strip()) <= 5:
+        return code.strip()
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_nuts_index():
+    """
+    Returns a read-only mapping of every NUTS code to its level, taken from `meta/` and
+    updated with the fetched `nuts` dimension, if stored
+    """
+    nuts_index = {row['nuts_id']: int(row['nuts_level']) for row in read_meta_csv(NUTS_FNAME)}
+    for row in read_dim_jsonl('nuts'):
+        code = get_nuts_code(row)
+        if code:
+            nuts_index[code] = len(code) - 2
+    return MappingProxyType(nuts_index)
+
+
+@lru_cache(maxsize=4096)
+def get_nuts_chain(nuts_code: str) -> tuple:
+    """ Returns the known NUTS codes from the country down to `nuts_code` (parents are code prefixes) """
+    nuts_index = get_nuts_index()
+    return tuple(nuts_code[:i] for i in range(2, len(nuts_code) + 1) if nuts_code[:i] in nuts_index)
+
+
+def get_nuts_levels(nuts_code) -> dict:
+    """ Returns `location_nuts_<level>` roll-up keys for a given NUTS code """
+    if not isinstance(nuts_code, str):
+        return {}
+    nuts_index = get_nuts_index()
+    return {f"location_nuts_{nuts_index[code]}": code for code in get_nuts_chain(nuts_code.strip())}
+
+
+@lru_cache(maxsize=16384)
+def get_cpv_levels_cached(cpv_code: str) -> MappingProxyType:
+    digits = cpv_code.split('-')[0]
+    if len(digits) != 8 or not digits.isdigit():
+        return MappingProxyType({})
+    depth = max(len(digits.rstrip('0')), 2)
+    return MappingProxyType({level: digits[:n].ljust(8, '0') for level, n in CPV_LEVELS if n <= depth})
+
+
+def get_cpv_levels(cpv_code) -> dict:
+    """ Returns `cpv_division`, `cpv_group` and `cpv_class` roll-up keys for a given CPV code """
+    if not isinstance(cpv_code, str):
+        return {}
+    return dict(get_cpv_levels_cached(cpv_code.strip()))
@@ -0,0 +1,171 @@
+"""
+Functions for denormalizing entity `.jsonl` files by joining them with related entities
+
+Joins build in-memory hash indexes holding only the selected fields of the smaller
+entity sets, as compact records, and stream the larger file through them, rewriting it in place.
+"""
+import json
+import logging
+import os
+
+from src.transformers.t_records import Record
+from src.utils import log
+
+# Fields attached to every CONT, as {source field: CONT field}
+CAUTH_JOIN_FIELDS = {
+    'type_authority': 'cauth_type_authority',
+    'type_main_activity': 'cauth_type_main_activity',
+    'location_nuts': 'cauth_location_nuts',
+}
+BIDDER_JOIN_FIELDS = {
+    'location_nuts': 'bidder_location_nuts',
+    'location_municipalty': 'bidder_location_municipalty',
+}
+
+
+class CauthJoin(Record):
+    __slots__ = CATEGORICAL = tuple(CAUTH_JOIN_FIELDS.values())
+
+
+class BidderJoin(Record):
+    __slots__ = tuple(BIDDER_JOIN_FIELDS.values()) + ('is_classified_bidder',)
+    CATEGORICAL = tuple(BIDDER_JOIN_FIELDS.values())
+
+
+def read_jsonl(fpath):
+    """ Yields every document of a `.jsonl` file as a dict """
+    with open(fpath, mode='r', encoding='utf8') as jsonl:
+        for doc in jsonl:
+            yield json.loads(doc)
+
+
+def rewrite_jsonl(fpath, docs):
+    """ Stores docs in `fpath`, replacing it only once every doc has been written """
+    tmp_fpath = fpath + '.tmp'
+    n_docs = 0
+    with open(tmp_fpath, mode='w', encoding='utf8') as jsonl:
+        for doc in docs:
+            jsonl.write(json.dumps(doc, ensure_ascii=False) + '\n')
+            n_docs += 1
+    os.replace(tmp_fpath, fpath)
+    log.count('records', n_docs)
+
+
+def get_join_index(fpath, key, fields, record_cls):
+    """ Returns a dict with `key` values as keys and `record_cls` records of the selected `fields` as values """
+    index = {}
+    for doc in read_jsonl(fpath):
+        index[doc[key]] = record_cls(**{field: doc[source] for source, field in fields.items()
+                                        if doc.get(source) is not None})
+    return index
+
+
+def get_enriched_conts(conts_fpath, cauths_index, bidders_index, misses):
+    for cont_d in read_jsonl(conts_fpath):
+        cauth_d = cauths_index.get(cont_d.get('cauth_cod_perfil'))
+        if cauth_d is None:
+            misses['cauth'] += 1
+        else:
+            cont_d.update(cauth_d)
+        bidder_d = bidders_index.get(cont_d.get('bidder_cif'))
+        if bidder_d is None:
+            misses['bidder'] += 1
+        else:
+            cont_d.update(bidder_d)
+        cont_d['is_classified_bidder'] = bool(bidder_d and bidder_d.get('is_classified_bidder'))
+        yield cont_d
+
+
+@log.start_end
+def enrich_conts_file(conts_path, cauths_path, bidders_path):
+    """ Attaches selected CAUTH and BIDDER attributes to every CONT in the CONT `.jsonl` file """
+    cauths_index = get_join_index(os.path.join(cauths_path, 'cauths.jsonl'), 'cod_perfil', CAUTH_JOIN_FIELDS,
+                                  CauthJoin)
+    bidders_index = get_join_index(os.path.join(bidders_path, 'bidders.jsonl'), 'cif',
+                                   BIDDER_JOIN_FIELDS | {'is_classified_bidder': 'is_classified_bidder'}, BidderJoin)
+    misses = {'cauth': 0, 'bidder': 0}
+    conts_fpath = os.path.join(conts_path, 'conts.jsonl')
+    rewrite_jsonl(conts_fpath, get_enriched_conts(conts_fpath, cauths_index, bidders_index, misses))
+    logging.info(f"CONTs without matching CAUTH: {misses['cauth']}, without matching BIDDER: {misses['bidder']}")
+
+
+# Fields attached to every CONT from its TENDER, as {source field: CONT field}
+TENDER_JOIN_FIELDS = {
+    'type_tender': 'tender_type',
+    'status_processing': 'tender_status_processing',
+    'duration_contract': 'tender_duration_contract',
+    'url_kontratazioa': 'tender_url_kontratazioa',
+    'odr_year': 'tender_odr_year',
+}
+
+
+class TenderJoin(Record):
+    __slots__ = tuple(TENDER_JOIN_FIELDS.values())
+    CATEGORICAL = ('tender_type', 'tender_status_processing', 'tender_duration_contract', 'tender_odr_year')
+
+
+def strip_value(value):
+    """ Strips the line breaks the `record` TENDER parser leaves around string values """
+    return value.strip() if isinstance(value, str) else value
+
+
+def get_tenders_index(tenders_fpath):
+    """ Returns a dict with TENDER `cod_exp` as keys and the selected TENDER fields as values """
+    tenders_index = {}
+    for tender_d in read_jsonl(tenders_fpath):
+        key = strip_value(tender_d.get('cod_exp'))
+        if not key:
+            continue
+        # The same tender may be announced in several yearly datasets, keep the most recent one
+        if key in tenders_index and tenders_index[key].get('tender_odr_year', '') > tender_d.get('odr_year', ''):
+            continue
+        tenders_index[key] = TenderJoin(**{field: strip_value(tender_d[source])
+                                           for source, field in TENDER_JOIN_FIELDS.items()
+                                           if tender_d.get(source) is not None})
+    return tenders_index
+
+
+def get_linked_conts(conts_fpath, tenders_index, links, unmatched_conts):
+    for cont_d in read_jsonl(conts_fpath):
+        key = strip_value(cont_d.get('tender_cod_exp'))
+        tender_d = tenders_index.get(key)
+        if tender_d is None:
+            unmatched_conts.add(key)
+        else:
+            cont_d.update(tender_d)
+            n_conts, amount = links.get(key, (0, 0))
+            links[key] = (n_conts + 1, amount + (cont_d.get('budget_with_vat') or 0))
+        yield cont_d
+
+
+def get_linked_tenders(tenders_fpath, links):
+    for tender_d in read_jsonl(tenders_fpath):
+        n_conts, amount = links.get(strip_value(tender_d.get('cod_exp')), (0, 0))
+        tender_d['n_conts'] = n_conts
+        tender_d['amount_awarded_with_vat'] = amount
+        yield tender_d
+
+
+@log.start_end
+def link_tenders_conts_files(tenders_path, conts_path):
+    """
+    Links TENDERs and CONTs through `cod_exp` / `tender_cod_exp`:
+        · Every CONT gets metadata of its TENDER.
+        · Every TENDER gets its number of CONTs and their total awarded amount.
+    Keys found only on one side are stored in a `links_report.json` file at `tenders_path`.
+    """
+    tenders_fpath = os.path.join(tenders_path, 'tenders.jsonl')
+    conts_fpath = os.path.join(conts_path, 'conts.jsonl')
+    tenders_index = get_tenders_index(tenders_fpath)
+    links = {}
+    unmatched_conts = set()
+    rewrite_jsonl(conts_fpath, get_linked_conts(conts_fpath, tenders_index, links, unmatched_conts))
+    rewrite_jsonl(tenders_fpath, get_linked_tenders(tenders_fpath, links))
+    unmatched_tenders = tenders_index.keys() - links.keys()
+    unmatched_conts.discard(None)
+    logging.info(f"TENDERs linked to CONTs: {len(links)}, "
+                 f"TENDERs without CONTs: {len(unmatched_tenders)}, "
+                 f"CONT `tender_cod_exp` without TENDER: {len(unmatched_conts)}")
+    with open(os.path.join(tenders_path, 'links_report.json'), mode='w', encoding='utf8') as file:
+        json.dump({'unmatched_tenders': sorted(unmatched_tenders), 'unmatched_conts': sorted(unmatched_conts)},
+                  file, ensure_ascii=False, indent=2)
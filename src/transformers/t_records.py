@@ -0,0 +1,62 @@
+"""
+Compact records for entity sets held whole in memory, such as bidders or join indexes
+
+Records keep their fields in `__slots__` instead of a dict of their own, and intern the values of
+their categorical fields (such as `location_nuts` or `status_processing`), so every record sharing a
+value shares the same string. They behave as read-only mappings of the fields set, so `dict(record)`
+or `{**record}` give the dict stored by sinks. Fields never set are left out, while None values are kept.
+"""
+import sys
+
+
+class Record:
+    """ Base record. Subclasses declare their fields as `__slots__` and the categorical ones in `CATEGORICAL` """
+    __slots__ = ()
+    CATEGORICAL = ()
+
+    def __init__(self, **fields):
+        for field, value in fields.items():
+            if field in self.CATEGORICAL:
+                value = intern_value(value)
+            setattr(self, field, value)
+
+    def keys(self):
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __contains__(self, field):
+        return field in self.__slots__ and hasattr(self, field)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self.__slots__ else default
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.keys()]
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return type(self) is type(other) and self.items() == other.items()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in self.items())})"
+
+
+def intern_value(value):
+    """ Interns a string, or the strings in a list (returned as a tuple), leaving other values as given """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return tuple(sys.intern(v) if isinstance(v, str) else v for v in value)
+    return value
@@ -4,33 +4,54 @@ import os
 
 from bs4 import BeautifulSoup
 
+from src.transformers.t_cache import ParseCache
+from src.transformers.t_dims import get_dims_version, get_nuts_levels
 from src.utils import log
 from src.transformers.t_tenders.p_cann import parse_contracting_announcement_xml
 from src.transformers.t_tenders.p_record import parse_record_xml
 
+# Version of the TENDER parsers, to be bumped whenever their output changes, invalidating cached results
+PARSER_VERSION = 2
+
 
 @log.start_end
-def get_tenders_file(path):
-    """ Parses and cleans raw TENDER `.xml` data and stores it in a TENDER `.jsonl` file """
+def get_tenders_file(path, workers=1, cache=True):
+    """
+    Parses and cleans raw TENDER `.xml` data and stores it in a TENDER `.jsonl` file.
+    With more than one worker, `.xml` files are parsed in that many processes.
+    Unless `cache` is False, only `.xml` files not parsed in previous runs are parsed.
+    """
     jsonl_path = os.path.join(path, 'tenders.jsonl')
-    with open(jsonl_path, 'w', encoding='utf-8') as jsonl:
-        raw_tenders_path = os.path.join(path, 'raw_xml_tenders')
-        # Iterating through every TENDER xml
-        for xml_filename in os.listdir(raw_tenders_path):
-            odr_year = xml_filename.split('_')[0]
-            with open(os.path.join(raw_tenders_path, xml_filename), mode='r', encoding='utf8') as file:
-                xml_file = file.read().replace('encoding="ISO-8859-1"', 'encoding="utf8"')
-                soup = BeautifulSoup(xml_file, 'xml')
-            try:
-                if soup.find('record'):
-                    clean_tender = parse_record_xml(soup)
-                elif soup.find('contractingAnnouncement'):
-                    clean_tender = parse_contracting_announcement_xml(soup)
-                else:
-                    logging.warning(f"No header match for file: {xml_filename}")
-                    continue
-                full_tender = clean_tender | {'odr_year': odr_year}
-                jsonl.write(json.dumps(full_tender, ensure_ascii=False) + '\n')
-            except (TypeError, AttributeError) as e:
-                logging.warning(f"Could not process {xml_filename}, {e}")
-                pass
+    raw_tenders_path = os.path.join(path, 'raw_xml_tenders')
+    xml_fpaths = [os.path.join(raw_tenders_path, xml_filename) for xml_filename in os.listdir(raw_tenders_path)]
+    counts = {'records': 0, 'skips': 0, 'failures': 0}
+    with open(jsonl_path, 'w', encoding='utf-8') as jsonl, \
+            ParseCache(path, 'tenders', f"{PARSER_VERSION}_{get_dims_version()}", enabled=cache) as parse_cache:
+        for status, line in parse_cache.map(get_tender_line, xml_fpaths, workers, chunksize=16):
+            counts[status] += 1
+            if line:
+                jsonl.write(line)
+    for counter, n in counts.items():
+        log.count(counter, n)
+
+
+def get_tender_line(xml_fpath):
+    """ Returns the outcome of parsing a TENDER `.xml` file (`records`, `skips` or `failures`) and its `.jsonl` line """
+    xml_filename = os.path.basename(xml_fpath)
+    odr_year = xml_filename.split('_')[0]
+    with open(xml_fpath, mode='r', encoding='utf8') as file:
+        xml_file = file.read().replace('encoding="ISO-8859-1"', 'encoding="utf8"')
+        soup = BeautifulSoup(xml_file, 'xml')
+    try:
+        if soup.find('record'):
+            clean_tender = parse_record_xml(soup)
+        elif soup.find('contractingAnnouncement'):
+            clean_tender = parse_contracting_announcement_xml(soup)
+        else:
+            logging.warning(f"No header match for file: {xml_filename}")
+            return 'skips', None
+        full_tender = clean_tender | {'odr_year': odr_year} | get_nuts_levels(clean_tender.get('location_nuts'))
+        return 'records', json.dumps(full_tender, ensure_ascii=False) + '\n'
+    except (TypeError, AttributeError) as e:
+        logging.warning(f"Could not process {xml_filename}, {e}")
+        return 'failures', None
@@ -38,13 +38,18 @@ def separate_duplicates(items):
         return list(dup_set), list(single_set)
 
 
+# Values taken as `null`
+NULL_VALUES = ("None", "", None, "Null", "null", "none")
+NULL_STRINGS = frozenset(value for value in NULL_VALUES if value is not None)
+
+
 def del_none(d: dict):
     """
     Delete keys with the `null` value in a dictionary, recursively.
     """
     for key, value in list(d.items()):
 
-        if value in ("None", "", None, "Null", "null", "none"):
+        if value in NULL_VALUES:
             del d[key]
 
         elif isinstance(value, dict):
@@ -66,6 +71,37 @@ def strip_dict(d):
     return d
 
 
+def del_none_fast(d: dict):
+    """ Returns a copy of a dictionary as `del_none` leaves it, checking `null` spellings in a single lookup """
+    return {k: (v if isinstance(v, str) else del_none_nested(v)) for k, v in d.items()
+            if v is not None and not (isinstance(v, str) and v in NULL_STRINGS)}
+
+
+def del_none_nested(value):
+    """ Returns dicts (or lists of dicts) without `null` values as `del_none` leaves them, and other values as given """
+    if isinstance(value, dict):
+        return del_none_fast(value)
+    if isinstance(value, list):
+        return [del_none_fast(element) if isinstance(element, dict) else element for element in value]
+    return value
+
+
+def strip_del_none_fast(d: dict):
+    """ Returns a copy of a dictionary as `del_none(strip_dict(d))` leaves it """
+    clean_d = {}
+    for k, v in d.items():
+        v = str(v).strip().removesuffix('.')
+        if v not in NULL_STRINGS:
+            clean_d[k] = v
+    return clean_d
+
+
+def del_none_strip_fast(d: dict):
+    """ Returns a copy of a dictionary as `strip_dict(del_none(d))` leaves it """
+    return {k: str(v if isinstance(v, str) else del_none_nested(v)).strip().removesuffix('.')
+            for k, v in d.items() if v is not None and not (isinstance(v, str) and v in NULL_STRINGS)}
+
+
 def check_no_matched_key(cont_d, known_keys):
     """ Raises an exception if unknown keys are found in the dict object """
     if not all([k in known_keys for k in cont_d]):
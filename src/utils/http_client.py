@@ -0,0 +1,116 @@
+"""
+HTTP client shared by every synchronous (`requests`) extractor
+
+    · Requests to a host go through the same keep-alive session, whose connection pool is reused
+    across threads and stages.
+    · Requests without a timeout are given `TIMEOUT`.
+    · Requests to a host are limited by a token bucket shared by every thread, refilled at `RATE`
+    requests per second and holding up to `BURST` tokens. `set_rate` changes it, 0 disabling the limit.
+    · Compressed responses (gzip, deflate and brotli when available) are accepted.
+
+Retries are handled on top of this client by `retries.request`.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+from src.utils import telemetry
+
+# Seconds to wait for a connection and for the server to send data
+TIMEOUT = (10, 60)
+# Requests per second (0 for no limit) and burst size allowed for every host, and connections kept alive per host
+RATE = 10
+BURST = 10
+POOL_SIZE = 16
+
+_sessions = {}
+_buckets = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, refilled at `rate` tokens per second and holding up to `burst` tokens.
+    A `rate` of 0 or less never makes callers wait.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            # Tokens earned so far are refilled at the previous rate
+            self.refill()
+            self.rate = rate
+            if rate <= 0:
+                self.tokens = self.burst
+
+    def reserve(self):
+        """ Takes a token, returning the seconds to wait for it to be available """
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            self.refill()
+            # Tokens may go negative, queueing callers in the order they asked
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+def new_session():
+    """ Returns a session with its own cookies, pooling connections and accepting compressed responses """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(make_headers(accept_encoding=True, keep_alive=True))
+    return session
+
+
+def get_session(url):
+    """ Returns the session shared by every request to the host of `url` """
+    with _lock:
+        host = urlsplit(url).netloc
+        if host not in _sessions:
+            _sessions[host] = new_session()
+        return _sessions[host]
+
+
+def set_rate(rate):
+    """ Sets the requests per second allowed for every host, including hosts already requested. 0 disables it """
+    global RATE
+    with _lock:
+        RATE = rate
+        for bucket in _buckets.values():
+            bucket.set_rate(rate)
+
+
+def get_bucket(url):
+    with _lock:
+        host = urlsplit(url).netloc
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(RATE, BURST)
+        return _buckets[host]
+
+
+def request(method, url, session=None, **kwargs):
+    """
+    `requests.request` through the session of the host (or `session`, if given), once the host rate
+    limit allows it, recording the telemetry of the call
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+    time.sleep(get_bucket(url).reserve())
+    return telemetry.request(method, url, session=session or get_session(url), **kwargs)
@@ -1,8 +1,23 @@
+import functools
+import json
 import logging
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+# Counters every span keeps track of
+COUNTERS = ('downloads', 'records', 'bytes', 'retries', 'skips', 'failures')
+METRICS_PREFIX = 'kontratazioa'
+
+# Top level spans of the current run, every span holding its nested spans
+_run_spans = []
+# Spans that have not finished yet, the innermost one being the last
+_open_spans = []
+_lock = threading.Lock()
+
 
 def start_log(path):
     # Enable logging and avoid urllib3 related logging
@@ -19,11 +34,88 @@ def start_log(path):
     logging.getLogger('urllib3').setLevel(logging.WARNING)
 
 
+@contextmanager
+def span(name):
+    """
+    Times the enclosed block as a span nested in the span currently open, if any.
+    Counters added while the span is open are added to it and to every enclosing span.
+    """
+    span_d = {'name': name, 'status': 'ok', 'seconds': None, 'cpu_seconds': None,
+              'counters': dict.fromkeys(COUNTERS, 0), 'spans': []}
+    with _lock:
+        (_open_spans[-1]['spans'] if _open_spans else _run_spans).append(span_d)
+        _open_spans.append(span_d)
+    logging.info("Start: " + name)
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield span_d
+    except BaseException:
+        span_d['status'] = 'failed'
+        raise
+    finally:
+        span_d['seconds'] = round(time.perf_counter() - start, 3)
+        span_d['cpu_seconds'] = round(time.process_time() - cpu_start, 3)
+        with _lock:
+            _open_spans.remove(span_d)
+        counters = ', '.join(f"{k}={v}" for k, v in span_d['counters'].items() if v)
+        logging.info(f"End: {name} [{span_d['status']}] in {span_d['seconds']}s" + (f" ({counters})" if counters else ""))
+
+
 def start_end(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        logging.info("Start: " + func.__name__)
-        value = func(*args, **kwargs)
-        logging.info("End: " + func.__name__)
-        return value
+        with span(func.__name__):
+            return func(*args, **kwargs)
 
     return wrapper
+
+
+def count(counter, n=1):
+    """ Adds `n` to `counter` on every open span """
+    with _lock:
+        for span_d in _open_spans:
+            span_d['counters'][counter] = span_d['counters'].get(counter, 0) + n
+
+
+def iter_spans(spans=None, parent=''):
+    """ Yields every span of the run along with its path of nested span names, as `stage/sub_step` """
+    for span_d in _run_spans if spans is None else spans:
+        path = '/'.join(filter(None, (parent, span_d['name'])))
+        yield path, span_d
+        yield from iter_spans(span_d['spans'], path)
+
+
+def get_prometheus_metrics():
+    """ Returns the measures of every span in Prometheus text exposition format """
+    measures = {
+        'seconds': ('gauge', "Wall time of the span in seconds", lambda s: s['seconds']),
+        'cpu_seconds': ('gauge', "CPU time of the process while the span was open", lambda s: s['cpu_seconds']),
+        'failed': ('gauge', "Whether the span raised an exception", lambda s: int(s['status'] == 'failed')),
+    }
+    for counter in COUNTERS:
+        measures[counter] = ('gauge', f"Number of {counter} counted within the span",
+                             lambda s, counter=counter: s['counters'].get(counter, 0))
+    spans = [(path, span_d) for path, span_d in iter_spans() if span_d['seconds'] is not None]
+    lines = []
+    for measure, (metric_type, description, get_value) in measures.items():
+        metric = f"{METRICS_PREFIX}_span_{measure}"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for path, span_d in spans:
+            lines.append(f'{metric}{{span="{path}"}} {get_value(span_d)}')
+    lines.append(f"# HELP {METRICS_PREFIX}_run_timestamp_seconds Time the metrics were written at")
+    lines.append(f"# TYPE {METRICS_PREFIX}_run_timestamp_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}_run_timestamp_seconds {time.time():.0f}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path):
+    """ Stores the spans of the run at `path` as `metrics.json` and `metrics.prom` files """
+    with open(os.path.join(path, 'metrics.json'), mode='w', encoding='utf8') as file:
+        json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'spans': _run_spans}, file, indent=2)
+    # Written under a temporary name, so textfile collectors never read a partial file
+    prom_fpath = os.path.join(path, 'metrics.prom')
+    with open(prom_fpath + '.part', mode='w', encoding='utf8') as file:
+        file.write(get_prometheus_metrics())
+    os.replace(prom_fpath + '.part', prom_fpath)
@@ -0,0 +1,84 @@
+"""
+Opt-in CPU and memory profiling of pipeline stages
+
+Disabled by default. Once enabled with `enable`, every stage decorated with `profile` is run under
+cProfile and tracemalloc, and its reports are stored in the profiles directory:
+    · `<stage>.pstats`: cProfile stats, to be opened with `pstats` or snakeviz.
+    · `<stage>_cpu.txt`: functions sorted by cumulative time.
+    · `<stage>_memory.txt`: peak traced memory and lines holding most memory at the end of the stage.
+"""
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+
+# Environment variable enabling profiling, either `all` or a comma separated list of stage names
+PROFILE_ENV = 'KONTRATAZIOA_PROFILE'
+N_TOP_LINES = 40
+# Number of frames stored by tracemalloc for every allocation
+N_FRAMES = 1
+
+_profiles_path = None
+_stages = None
+_active = False
+
+
+def enable(profiles_path, stages=None):
+    """ Profiles the given `stages` (all of them when None), storing the reports at `profiles_path` """
+    global _profiles_path, _stages
+    os.makedirs(profiles_path, exist_ok=True)
+    _profiles_path = profiles_path
+    _stages = set(stages) if stages else None
+    logging.info(f"Profiling {', '.join(sorted(_stages)) if _stages else 'all stages'} into {profiles_path}")
+
+
+def enable_from_env(profiles_path):
+    """ Enables profiling if the `KONTRATAZIOA_PROFILE` environment variable is set """
+    value = os.environ.get(PROFILE_ENV, '').strip()
+    if not value or value == '0':
+        return
+    stages = None if value.lower() in ('1', 'all', 'true') else [s.strip() for s in value.split(',') if s.strip()]
+    enable(profiles_path, stages)
+
+
+def write_reports(name, profiler, snapshot, peak):
+    profiler.dump_stats(os.path.join(_profiles_path, f"{name}.pstats"))
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(N_TOP_LINES)
+    with open(os.path.join(_profiles_path, f"{name}_cpu.txt"), mode='w', encoding='utf8') as file:
+        file.write(stream.getvalue())
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    with open(os.path.join(_profiles_path, f"{name}_memory.txt"), mode='w', encoding='utf8') as file:
+        file.write(f"Peak traced memory: {peak / 1024 ** 2:.1f} MB\n\n")
+        for stat in snapshot.statistics('lineno')[:N_TOP_LINES]:
+            file.write(f"{stat}\n")
+
+
+def profile(func):
+    """ Runs the decorated stage under cProfile and tracemalloc when profiling is enabled for it """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _active
+        # Nested stages are already covered by the profile of the outer one
+        if _profiles_path is None or _active or (_stages is not None and func.__name__ not in _stages):
+            return func(*args, **kwargs)
+        _active = True
+        profiler = cProfile.Profile()
+        tracemalloc.start(N_FRAMES)
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _active = False
+            write_reports(func.__name__, profiler, snapshot, peak)
+            logging.info(f"Profile of {func.__name__} stored in {_profiles_path}")
+
+    return wrapper
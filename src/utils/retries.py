@@ -0,0 +1,175 @@
+"""
+Retry policy shared by the synchronous (`requests`) and asynchronous (aiohttp) extractors
+
+    · Failed attempts are retried after an exponential backoff with full jitter, or after
+    the delay given by the server in a `Retry-After` header.
+    · A per-host circuit breaker pauses every request to a host after several consecutive
+    failures, instead of letting each request hammer it on its own.
+    · Once every attempt has failed, a `RetryError` is raised.
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from src.utils import http_client, log, telemetry
+
+ATTEMPTS = 5
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+# Response status codes worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Consecutive failures opening the circuit of a host, and seconds requests to it are paused for
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+
+_hosts = {}
+_lock = threading.Lock()
+
+
+class RetryError(Exception):
+    """ Raised when every attempt of a request or function failed """
+
+
+def get_backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """ Returns the seconds to wait after the failed `attempt` (1 based), with full jitter """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def get_retry_after(headers):
+    """ Returns the seconds given by a `Retry-After` header, either as a number or as a date """
+    value = (headers or {}).get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_host_state(url):
+    """ Must be called holding `_lock` """
+    return _hosts.setdefault(urlsplit(url).netloc, {'failures': 0, 'paused_until': 0.0})
+
+
+def get_host_pause(url):
+    """ Returns the seconds requests to the host of `url` must wait before being sent """
+    with _lock:
+        return max(0.0, get_host_state(url)['paused_until'] - time.monotonic())
+
+
+def pause_host(url, seconds):
+    with _lock:
+        host_d = get_host_state(url)
+        host_d['paused_until'] = max(host_d['paused_until'], time.monotonic() + seconds)
+
+
+def record_success(url):
+    with _lock:
+        get_host_state(url)['failures'] = 0
+
+
+def record_failure(url):
+    """ Counts a failed attempt, opening the circuit of the host once it fails too many times in a row """
+    with _lock:
+        host_d = get_host_state(url)
+        host_d['failures'] += 1
+        if host_d['failures'] < BREAKER_THRESHOLD:
+            return
+        host_d['failures'] = 0
+        host_d['paused_until'] = max(host_d['paused_until'], time.monotonic() + BREAKER_COOLDOWN)
+    logging.warning(f"Too many failures in a row for {urlsplit(url).netloc}, pausing it for {BREAKER_COOLDOWN}s")
+
+
+def get_retry_delay(url, attempt, headers=None):
+    """ Records a failed attempt and returns the seconds to wait before the next one """
+    record_failure(url)
+    telemetry.record_retry(url)
+    log.count('retries')
+    retry_after = get_retry_after(headers)
+    if retry_after is not None:
+        # The server asked every client to slow down, not only this request
+        pause_host(url, retry_after)
+        return retry_after
+    return get_backoff(attempt)
+
+
+def request(method, url, attempts=ATTEMPTS, **kwargs):
+    """
+    `http_client.request` retrying connection errors, timeouts and `RETRY_STATUSES` responses.
+    Responses with other statuses are returned as they are.
+    """
+    for attempt in range(1, attempts + 1):
+        time.sleep(get_host_pause(url))
+        headers = None
+        try:
+            r = http_client.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        else:
+            if r.status_code not in RETRY_STATUSES:
+                record_success(url)
+                return r
+            error = requests.HTTPError(f"{r.status_code} {r.reason}", response=r)
+            headers = r.headers
+            r.close()
+        if attempt < attempts:
+            time.sleep(get_retry_delay(url, attempt, headers))
+        else:
+            record_failure(url)
+    raise RetryError(f"{method} {url} failed after {attempts} attempts: {error!r}") from error
+
+
+async def async_sleep_host_pause(url):
+    pause = get_host_pause(url)
+    if pause:
+        await asyncio.sleep(pause)
+
+
+def retry(times, exceptions, url_kwarg='url'):
+    """
+    Retries the wrapped function `times` times if any of `exceptions` is raised, with the backoff
+    and circuit breaker of the host in its `url_kwarg` keyword argument, if given.
+    Raises `RetryError` once every attempt failed.
+    """
+
+    def decorator(func):
+        def newfn(*args, **kwargs):
+            url = kwargs.get(url_kwarg)
+            for attempt in range(1, times + 1):
+                if url:
+                    time.sleep(get_host_pause(url))
+                try:
+                    value = func(*args, **kwargs)
+                except exceptions as e:
+                    logging.warning(f'Exception thrown when attempting to run "{func.__name__}", '
+                                    f'attempt {attempt} of {times} with kwargs: {kwargs}: {e!r}')
+                    error = e
+                else:
+                    if url:
+                        record_success(url)
+                    return value
+                if attempt == times:
+                    if url:
+                        record_failure(url)
+                    break
+                if url:
+                    time.sleep(get_retry_delay(url, attempt))
+                else:
+                    log.count('retries')
+                    time.sleep(get_backoff(attempt))
+            raise RetryError(f'Unable to succesfully run "{func.__name__}" after {times} attempts. '
+                             f'Params: ({kwargs})') from error
+
+        return newfn
+
+    return decorator
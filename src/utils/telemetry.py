@@ -0,0 +1,141 @@
+"""
+Per-host telemetry of the HTTP requests sent by the extractors
+
+Both the aiohttp downloader and the `requests` calls record latency, status codes,
+retries, timeouts and bytes transferred, which are summarised at the end of every stage.
+"""
+import functools
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+# Number of slowest requests kept
+SLOWEST_N = 10
+
+_hosts = {}
+_slowest = []
+_lock = threading.Lock()
+
+
+def get_host_stats(url):
+    """ Returns the stats of the host of `url`, creating them if needed. Must be called holding `_lock` """
+    host = urlsplit(url).netloc
+    if host not in _hosts:
+        _hosts[host] = {'requests': 0, 'status': {}, 'retries': 0, 'timeouts': 0, 'bytes': 0,
+                        'latency_sum': 0.0, 'latency_buckets': [0] * len(LATENCY_BUCKETS)}
+    return _hosts[host]
+
+
+def record(url, seconds, status, n_bytes=0):
+    """ Records a request to `url` answered with `status` (or an error name) after `seconds` """
+    with _lock:
+        host_d = get_host_stats(url)
+        host_d['requests'] += 1
+        host_d['status'][str(status)] = host_d['status'].get(str(status), 0) + 1
+        host_d['bytes'] += n_bytes
+        host_d['latency_sum'] += seconds
+        host_d['latency_buckets'][next(i for i, le in enumerate(LATENCY_BUCKETS) if seconds <= le)] += 1
+        if len(_slowest) < SLOWEST_N:
+            heapq.heappush(_slowest, (seconds, url))
+        elif seconds > _slowest[0][0]:
+            heapq.heapreplace(_slowest, (seconds, url))
+
+
+def record_retry(url):
+    with _lock:
+        get_host_stats(url)['retries'] += 1
+
+
+def record_timeout(url, seconds):
+    with _lock:
+        get_host_stats(url)['timeouts'] += 1
+    record(url, seconds, 'timeout')
+
+
+def request(method, url, session=None, **kwargs):
+    """ `requests.request` recording the telemetry of the call, sent through `session` if given """
+    start = time.perf_counter()
+    try:
+        r = (session or requests).request(method, url, **kwargs)
+    except requests.Timeout:
+        record_timeout(url, time.perf_counter() - start)
+        raise
+    except requests.RequestException as e:
+        record(url, time.perf_counter() - start, type(e).__name__)
+        raise
+    # Streamed bodies have not been read yet, rely on the size announced by the server
+    n_bytes = int(r.headers.get('Content-Length', 0)) if kwargs.get('stream') else len(r.content)
+    record(url, time.perf_counter() - start, r.status_code, n_bytes)
+    return r
+
+
+def get_latency_quantile(host_d, q):
+    """ Returns the upper bound of the histogram bucket holding the `q` quantile of latencies """
+    target = q * sum(host_d['latency_buckets'])
+    cumulative = 0
+    for le, n in zip(LATENCY_BUCKETS, host_d['latency_buckets']):
+        cumulative += n
+        if n and cumulative >= target:
+            return le
+    return None
+
+
+def get_summary():
+    with _lock:
+        hosts = {}
+        for host, host_d in _hosts.items():
+            n_requests = host_d['requests']
+            hosts[host] = {
+                'requests': n_requests,
+                'status': dict(sorted(host_d['status'].items())),
+                'retries': host_d['retries'],
+                'timeouts': host_d['timeouts'],
+                'mb': round(host_d['bytes'] / 1024 ** 2, 2),
+                'latency_mean': round(host_d['latency_sum'] / n_requests, 3) if n_requests else None,
+                'latency_p50': get_latency_quantile(host_d, 0.5),
+                'latency_p95': get_latency_quantile(host_d, 0.95),
+                'latency_buckets': {str(le): n for le, n in zip(LATENCY_BUCKETS, host_d['latency_buckets'])},
+            }
+        slowest = [{'seconds': round(seconds, 3), 'url': url} for seconds, url in sorted(_slowest, reverse=True)]
+    return {'hosts': hosts, 'slowest': slowest}
+
+
+def reset():
+    with _lock:
+        _hosts.clear()
+        _slowest.clear()
+
+
+def summarize(func):
+    """
+    Decorator for stages taking their data path as first argument: logs the telemetry of the
+    requests sent while running the stage and stores it in a `http_telemetry.json` file there
+    """
+
+    @functools.wraps(func)
+    def wrapper(path, *args, **kwargs):
+        reset()
+        try:
+            return func(path, *args, **kwargs)
+        finally:
+            summary = get_summary()
+            for host, host_d in summary['hosts'].items():
+                logging.info(f"HTTP {func.__name__} {host}: {host_d['requests']} requests, status {host_d['status']}, "
+                             f"{host_d['retries']} retries, {host_d['timeouts']} timeouts, {host_d['mb']} MB, "
+                             f"latency mean {host_d['latency_mean']}s, p50 <= {host_d['latency_p50']}s, "
+                             f"p95 <= {host_d['latency_p95']}s")
+            for slow_d in summary['slowest'][:3]:
+                logging.info(f"HTTP {func.__name__} slowest: {slow_d['seconds']}s {slow_d['url']}")
+            if os.path.isdir(path):
+                with open(os.path.join(path, 'http_telemetry.json'), mode='w', encoding='utf8') as file:
+                    json.dump(summary, file, indent=2)
+
+    return wrapper
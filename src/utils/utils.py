@@ -1,33 +1,12 @@
 import hashlib
-import logging
-import time
+import json
+import os
+import re
+import shutil
 from datetime import date
 
-
-def retry(times, exceptions, sleep=5):
-    """
-    Retry Decorator
-    Retries the wrapped function/method `times` times if the exceptions listed
-    in ``exceptions`` are thrown
-    """
-
-    def decorator(func):
-        def newfn(*args, **kwargs):
-            attempt = 1
-            while attempt < times + 1:
-                try:
-                    return func(*args, **kwargs)
-                except exceptions:
-                    logging.warning(f'Exception thrown when attempting to run "{func.__name__}",'
-                                    f'attempt {attempt} of {times} with kwargs: {kwargs}')
-                    time.sleep(sleep)
-                    attempt += 1
-            logging.warning(f'Unable to succesfully run "{func.__name__}" after {times} attempts. Params: ({kwargs})')
-            return 0
-
-        return newfn
-
-    return decorator
+# Characters that may follow a number or literal in a JSON array
+SCALAR_END = re.compile(r'[\s,\]]')
 
 
 def get_current_year() -> int:
@@ -42,3 +21,78 @@ def get_hash(s):
 
 def flatten(xss):
     return [x for xs in xss for x in xs]
+
+
+def iter_json_array(chunks):
+    """
+    Yields every element of a JSON array as soon as it has been fully read from `chunks`, an iterable
+    of strings. Text around the array, such as a JSONP `jsonCallback(...);` wrapper, is ignored.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    in_array = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        if not in_array:
+            pos = buffer.find('[') + 1
+            if not pos:
+                continue
+            in_array = True
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                return
+            # Numbers and literals may go on in the next chunk, so they are only decoded once a delimiter follows
+            if buffer[pos] not in '{["' and not SCALAR_END.search(buffer, pos):
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element is not complete yet
+                break
+            while end < len(buffer) and buffer[end] in ' \t\r\n':
+                end += 1
+            if end == len(buffer):
+                break
+            if buffer[end] not in ',]':
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, end)
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+    if buffer.strip():
+        raise json.JSONDecodeError("Unterminated array", buffer, 0)
+
+
+def get_previous_path(path):
+    """
+    Given a `data/<YYYYMMDD>/<scope>` path, returns the same scope path for the
+    latest previous operation date, or None if there is no previous run
+    """
+    date_path, scope = os.path.split(os.path.normpath(path))
+    data_path, op_date = os.path.split(date_path)
+    prev_dates = [d for d in os.listdir(data_path)
+                  if d.isdigit() and d < op_date and os.path.isdir(os.path.join(data_path, d, scope))]
+    if not prev_dates:
+        return None
+    return os.path.join(data_path, max(prev_dates), scope)
+
+
+def reuse_file(fname, prev_path, path):
+    """
+    Makes `fname` available at `path`, hard-linking (or copying) it from `prev_path` if needed.
+    Returns False if the file is not available at any of them.
+    """
+    fpath = os.path.join(path, fname)
+    if os.path.isfile(fpath):
+        return True
+    if not prev_path or not os.path.isfile(os.path.join(prev_path, fname)):
+        return False
+    try:
+        os.link(os.path.join(prev_path, fname), fpath)
+    except OSError:
+        shutil.copy2(os.path.join(prev_path, fname), fpath)
+    return True
@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.extractors import e_dims
+from src.transformers import t_dims
+
+
+class DimsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self.tmp_dir.name
+        t_dims.get_nuts_index.cache_clear()
+        t_dims.get_nuts_chain.cache_clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        t_dims.get_nuts_index.cache_clear()
+        t_dims.get_nuts_chain.cache_clear()
+
+    def get_dims(self, dim_lines):
+        with mock.patch.object(e_dims, 'get_dim_lines', lambda name: dim_lines.get(name)):
+            e_dims.get_dims(self.path, ttl=0)
+
+    def test_empty_or_failed_fetch_keeps_stored_dimension(self):
+        self.get_dims({'nuts': ['{"codigo": "ES21"}\n']})
+        fname = t_dims.get_dims_state(self.path)['nuts']['fname']
+        with mock.patch.object(e_dims, 'get_dim_lines', lambda name: None):
+            e_dims.get_dims(self.path, ttl=0)
+        self.assertEqual(t_dims.get_dims_state(self.path)['nuts']['fname'], fname)
+        self.assertEqual(list(t_dims.read_dim_jsonl('nuts', self.path)), [{'codigo': 'ES21'}])
+
+    def test_nuts_levels_use_fetched_dimension(self):
+        self.get_dims({'nuts': ['{"codigo": "ESZZ9"}\n']})
+        with mock.patch.object(t_dims, 'DIMS_PATH', self.path):
+            self.assertEqual(t_dims.get_nuts_levels('ESZZ9')['location_nuts_3'], 'ESZZ9')
+
+    def test_nuts_levels_fall_back_to_meta(self):
+        with mock.patch.object(t_dims, 'DIMS_PATH', self.path):
+            self.assertEqual(t_dims.get_nuts_levels('ES213'), {'location_nuts_0': 'ES', 'location_nuts_1': 'ES2',
+                                                               'location_nuts_2': 'ES21', 'location_nuts_3': 'ES213'})
+            self.assertNotIn('ESZZ9', t_dims.get_nuts_index())
+
+    def test_dims_version_changes_with_fetched_nuts(self):
+        self.assertEqual(t_dims.get_dims_version(self.path), 'meta')
+        self.get_dims({'nuts': ['{"codigo": "ES21"}\n']})
+        self.assertNotEqual(t_dims.get_dims_version(self.path), 'meta')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.extractors import e_utils
+
+# Seconds a download pipeline is given before it is considered hung
+TIMEOUT = 10
+
+
+async def collect_downloads(urls_fpaths, concurrency=2):
+    async def collect():
+        return [event async for event in e_utils.iter_downloads(urls_fpaths, concurrency)]
+
+    return await asyncio.wait_for(collect(), TIMEOUT)
+
+
+async def fetch_html(session, **kwargs):
+    return 200, 'body'
+
+
+class IterDownloadsTest(unittest.TestCase):
+
+    def test_raising_urls_iterable_is_raised(self):
+        def urls_fpaths():
+            yield {'url': 'http://localhost/a', 'method': 'GET'}, os.devnull
+            raise ValueError("listing failed")
+
+        with mock.patch.object(e_utils, 'fetch_html', fetch_html):
+            with self.assertRaises(ValueError):
+                asyncio.run(collect_downloads(urls_fpaths()))
+
+    def test_raising_download_is_raised(self):
+        with tempfile.TemporaryDirectory() as path:
+            fpath = os.path.join(path, 'missing_dir', 'a.html')
+            urls_fpaths = [({'url': 'http://localhost/a', 'method': 'GET'}, fpath)]
+            with mock.patch.object(e_utils, 'fetch_html', fetch_html):
+                with self.assertRaises(FileNotFoundError):
+                    asyncio.run(collect_downloads(urls_fpaths))
+                with self.assertRaises(FileNotFoundError):
+                    e_utils.async_download_urls(urls_fpaths, concurrency=2)
+
+    def test_downloads_are_yielded(self):
+        with tempfile.TemporaryDirectory() as path:
+            urls_fpaths = [({'url': f'http://localhost/{i}', 'method': 'GET'}, os.path.join(path, f'{i}.html'))
+                           for i in range(5)]
+            with mock.patch.object(e_utils, 'fetch_html', fetch_html):
+                events = asyncio.run(collect_downloads(urls_fpaths))
+            self.assertEqual(sorted(event.fpath for event in events), sorted(fpath for _, fpath in urls_fpaths))
+            self.assertTrue(all(event.status == 200 for event in events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.extractors import e_recs
+
+
+def get_rec(rec_id, day):
+    return {'idResolucion': rec_id, 'fechaResolucion': f"2022-12-{day:02d}"}
+
+
+class GetRecsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        prev_path = os.path.join(self.tmp_dir.name, '20990101', 'recs')
+        self.path = os.path.join(self.tmp_dir.name, '20990102', 'recs')
+        os.makedirs(prev_path)
+        # The previous run saw RECs 1 to 4
+        with open(os.path.join(prev_path, 'recs.jsonl'), 'w', encoding='utf8') as file:
+            file.writelines(json.dumps(get_rec(i, 10 - i)) + '\n' for i in range(1, 5))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_recs(self, pages):
+        """ Runs `get_recs` over the listing `pages`, returning the stored RECs and the number of pages fetched """
+        fetched = []
+
+        def iter_rec_pages():
+            for page in pages:
+                fetched.append(page)
+                yield page
+
+        with mock.patch.object(e_recs, 'iter_rec_pages', iter_rec_pages):
+            e_recs.get_recs(self.path)
+        with open(os.path.join(self.path, 'recs.jsonl'), encoding='utf8') as file:
+            return sorted(json.loads(line)['idResolucion'] for line in file), len(fetched)
+
+    def test_sorted_listing_stops_at_seen_page(self):
+        pages = [[get_rec(6, 9), get_rec(5, 9)], [get_rec(1, 9), get_rec(2, 8)], [get_rec(3, 7), get_rec(4, 6)]]
+        self.assertEqual(self.get_recs(pages), ([1, 2, 3, 4, 5, 6], 2))
+
+    def test_unsorted_listing_is_fetched_whole(self):
+        pages = [[get_rec(5, 1), get_rec(6, 9)], [get_rec(1, 9), get_rec(2, 8)], [get_rec(7, 2)]]
+        self.assertEqual(self.get_recs(pages), ([1, 2, 3, 4, 5, 6, 7], 3))
+
+    def test_undated_listing_is_fetched_whole(self):
+        pages = [[{'idResolucion': 5}], [{'idResolucion': 1}], [{'idResolucion': 7}]]
+        self.assertEqual(self.get_recs(pages), ([1, 2, 3, 4, 5, 7], 3))
+
+    def test_ignored_paging_stops(self):
+        page = [get_rec(5, 1), get_rec(6, 9)]
+        self.assertEqual(self.get_recs([page] * 5), ([1, 2, 3, 4, 5, 6], 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.transformers.t_cache import CACHE_FNAME, ParseCache
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'data', '20990101', 'tenders')
+        os.makedirs(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, fname, text):
+        fpath = os.path.join(self.path, fname)
+        with open(fpath, 'w', encoding='utf8') as file:
+            file.write(text)
+        return fpath
+
+    def run_cache(self, fpaths, scope='tenders'):
+        with ParseCache(self.path, scope, 1) as parse_cache:
+            return list(parse_cache.map(lambda fpath: os.path.basename(fpath), fpaths))
+
+    def count_rows(self, scope='tenders'):
+        db = sqlite3.connect(os.path.join(self.tmp_dir.name, 'data', CACHE_FNAME))
+        try:
+            return db.execute("SELECT COUNT(*) FROM results WHERE scope = ?", (scope,)).fetchone()[0]
+        finally:
+            db.close()
+
+    def test_changed_files_replace_their_results(self):
+        a_fpath, b_fpath = self.write('a.xml', 'a'), self.write('b.xml', 'b')
+        self.run_cache([a_fpath, b_fpath])
+        self.run_cache([a_fpath], scope='conts')
+        for i in range(3):
+            self.write('a.xml', f"a{i}")
+            self.assertEqual(self.run_cache([a_fpath, b_fpath]), ['b.xml', 'a.xml'])
+            self.assertEqual(self.count_rows(), 2)
+        # Other scopes are left as they are
+        self.assertEqual(self.count_rows('conts'), 1)
+
+    def test_failed_run_keeps_results(self):
+        a_fpath, b_fpath = self.write('a.xml', 'a'), self.write('b.xml', 'b')
+        self.run_cache([a_fpath, b_fpath])
+        with self.assertRaises(ValueError):
+            with ParseCache(self.path, 'tenders', 1) as parse_cache:
+                next(parse_cache.map(os.path.basename, [a_fpath, b_fpath]))
+                raise ValueError
+        self.assertEqual(self.count_rows(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
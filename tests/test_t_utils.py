@@ -0,0 +1,39 @@
+import json
+import unittest
+
+from benchmarks.b_cleaners import CLEANERS, copy_records, get_records
+from src.transformers.t_utils import del_none_fast, del_none_strip_fast, strip_del_none_fast
+
+
+class FastCleanersTest(unittest.TestCase):
+    """ Fast cleaners must return the same records, with keys in the same order, as the calls they replace """
+
+    def assert_same_records(self, name, records):
+        cleaner, reference = CLEANERS[name]
+        for record in records:
+            with self.subTest(record=record):
+                expected = json.dumps(reference(copy_records(record)))
+                self.assertEqual(json.dumps(cleaner(copy_records(record))), expected)
+
+    def test_samples_and_generated_records(self):
+        records = get_records(1000)
+        for name in CLEANERS:
+            self.assert_same_records(name, records)
+
+    def test_null_spellings(self):
+        record = {'a': 'None', 'b': '', 'c': None, 'd': 'Null', 'e': 'null', 'f': 'none', 'g': 'NONE', 'h': 0,
+                  'i': False, 'j': {'k': 'null', 'l': [{'m': None}, None, 'null']}}
+        self.assertEqual(del_none_fast(copy_records(record)),
+                         {'g': 'NONE', 'h': 0, 'i': False, 'j': {'l': [{}, None, 'null']}})
+        for name in CLEANERS:
+            self.assert_same_records(name, [record])
+
+    def test_strip_order(self):
+        record = {'a': ' ', 'b': ' x. ', 'c': None, 'd': 1.0, 'e': '.'}
+        # Values stripped before removing nulls are removed once empty, and kept as empty strings otherwise
+        self.assertEqual(strip_del_none_fast(dict(record)), {'b': 'x', 'd': '1.0'})
+        self.assertEqual(del_none_strip_fast(dict(record)), {'a': '', 'b': 'x', 'd': '1.0', 'e': ''})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import json
+import unittest
+
+from src.utils.utils import iter_json_array
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    """ Elements must be decoded the same wherever the chunks are split """
+
+    def test_split_tokens(self):
+        self.assertEqual(list(iter_json_array(['[1, 2', '3, 4]'])), [1, 23, 4])
+        self.assertEqual(list(iter_json_array(['[tr', 'ue, nu', 'll, 1.', '5e', '2]'])), [True, None, 150.0])
+        self.assertEqual(list(iter_json_array(['[{"a": "b', '"}, "c', '"]'])), [{'a': 'b'}, 'c'])
+
+    def test_every_split(self):
+        text = 'jsonCallback([{"url": "http://a/1.xml", "n": 12}, 345, "x,]", [6, 7], true, -8.5e1 ]);'
+        expected = json.loads(text[len('jsonCallback('):-len(');')])
+        for i in range(len(text)):
+            for j in range(i, len(text)):
+                with self.subTest(i=i, j=j):
+                    self.assertEqual(list(iter_json_array([text[:i], text[i:j], text[j:]])), expected)
+
+    def test_invalid_arrays(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_array(['[1, 2']))
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_array(['[1 2]']))
+
+
+if __name__ == '__main__':
+    unittest.main()